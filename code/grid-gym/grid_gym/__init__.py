@@ -40,3 +40,21 @@ register(id='GridWorldSpiral52x50-v0',
          max_episode_steps=52*50
          )
 
+
+# Batched environments, gym.make(id, num_envs=N). Episode length is handled by the env itself, as the TimeLimit
+# wrapper only supports a single done flag.
+register(id='GridWorld42x42Vec-v0',
+         entry_point='grid_gym.envs:GridWorld42x42Vec'
+         )
+
+register(id='GridWorldBox11x11Vec-v0',
+         entry_point='grid_gym.envs:GridWorldBox11x11Vec'
+         )
+
+register(id='GridWorldSpiral28x28Vec-v0',
+         entry_point='grid_gym.envs:GridWorldSpiral28x28Vec'
+         )
+
+register(id='GridWorldSpiral52x50Vec-v0',
+         entry_point='grid_gym.envs:GridWorldSpiral52x50Vec'
+         )
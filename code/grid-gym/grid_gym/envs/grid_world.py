@@ -2,51 +2,267 @@ import gym
 import numpy as np
 from gym import spaces
 import copy
+import functools
+import math
 import os
 
 np.set_printoptions(linewidth=150)
 
 
-class SimpleGridWorld(gym.Env):
+OBS_MODES = ('onehot', 'index', 'view')
+
+
+@functools.lru_cache(maxsize=None)
+def shared_identity(num_cells: int) -> np.ndarray:
+    """"
+    Read-only float32 identity matrix shared by all envs with num_cells cells, whose rows are one-hot observations.
+    """
+    identity = np.eye(num_cells, dtype=np.float32)
+    identity.setflags(write=False)
+    return identity
+
+
+def one_hot_cells(cells: np.ndarray, num_cells: int) -> np.ndarray:
+    """"
+    Expand a batch of integer cell ids into a [batch, num_cells] array of one-hot observations at once.
+    """
+    cells = np.asarray(cells, dtype=np.int64).reshape((-1,))
+    states = np.zeros((cells.shape[0], num_cells))
+    states[np.arange(cells.shape[0]), cells] = 1
+    return states
+
+
+class VisitationStats:
+    def __init__(self, num_cells: int, max_count: int):
+        """"
+        Histogram of the visitation counts of num_cells grid cells. A count change of one cell is O(1), and so is the
+        sum of |k - count| over the cells for a k that moved little since the last call, which lets the exploration
+        metrics be updated without touching the grid.
+        For every min_count asked for, the cells with min_count <= count < ceil(k) are tracked as a number of cells
+        and a sum of counts, and the boundary is moved one histogram bucket at a time when k changes.
+        """
+        self.num_cells = num_cells
+        self.max_count = max_count
+        self.hist = [0] * (max_count + 2)
+        self.hist[0] = num_cells
+        self.total = 0
+        self.visited = 0
+        self._below = {}  # min_count -> [boundary, number of cells below, sum of counts below]
+
+    def change(self, old: int, new: int):
+        assert 0 <= new <= self.max_count, f'Count {new} is out of the histogram range.'
+        self.hist[old] -= 1
+        self.hist[new] += 1
+        self.total += new - old
+        self.visited += (new > 0) - (old > 0)
+        for min_count, below in self._below.items():
+            if min_count <= old < below[0]:
+                below[1] -= 1
+                below[2] -= old
+            if min_count <= new < below[0]:
+                below[1] += 1
+                below[2] += new
+
+    def change_batch(self, old: np.ndarray, new: np.ndarray):
+        """"
+        Count changes of a batch of distinct cells at once. Only the histogram update loops, over the distinct counts.
+        """
+        assert ((0 <= new) & (new <= self.max_count)).all(), 'Count is out of the histogram range.'
+        counts, inverse = np.unique(np.concatenate((old, new)), return_inverse=True)
+        signs = np.concatenate((-np.ones(len(old)), np.ones(len(new))))
+        hist_delta = np.bincount(inverse.reshape((-1,)), weights=signs, minlength=len(counts)).astype(np.int64)
+        for count, delta in zip(counts[hist_delta != 0].tolist(), hist_delta[hist_delta != 0].tolist()):
+            self.hist[count] += delta
+        self.total += int(new.sum() - old.sum())
+        self.visited += int((new > 0).sum() - (old > 0).sum())
+        for min_count, below in self._below.items():
+            old_below = (min_count <= old) & (old < below[0])
+            new_below = (min_count <= new) & (new < below[0])
+            below[1] += int(new_below.sum() - old_below.sum())
+            below[2] += int(new[new_below].sum() - old[old_below].sum())
+
+    def abs_diff_sum(self, k: float, min_count: int = 0) -> float:
+        """"
+        Sum of |k - count| over all cells with count >= min_count.
+        """
+        below = self._below.setdefault(min_count, [min_count, 0, 0])
+        boundary = min(max(math.ceil(k), min_count), self.max_count + 1)
+        hist = self.hist
+        while below[0] < boundary:
+            below[1] += hist[below[0]]
+            below[2] += below[0] * hist[below[0]]
+            below[0] += 1
+        while below[0] > boundary:
+            below[0] -= 1
+            below[1] -= hist[below[0]]
+            below[2] -= below[0] * hist[below[0]]
+        cells, sums = self.num_cells, self.total
+        for c in range(min_count):
+            cells -= hist[c]
+            sums -= c * hist[c]
+        return (k * below[1] - below[2]) + (sums - below[2]) - k * (cells - below[1])
+
+
+class VisitationHistory:
+    def __init__(self, capacity: int):
+        """"
+        Sliding window of the last capacity visited cells, kept as flat cell indices in a fixed-size ring array.
+        Adding a cell to a full window evicts the oldest one.
+        """
+        self.capacity = capacity
+        self.cells = np.zeros(capacity, dtype=np.int64)
+        self.next_idx = 0
+        self.num_stored = 0
+
+    def __len__(self):
+        return self.num_stored
+
+    def add(self, cell: int) -> int:
+        """"
+        Add a cell and return the evicted cell, or -1 if the window was not full yet.
+        """
+        evicted = int(self.cells[self.next_idx]) if self.num_stored == self.capacity else -1
+        self.cells[self.next_idx] = cell
+        self.next_idx = (self.next_idx + 1) % self.capacity
+        self.num_stored = min(self.num_stored + 1, self.capacity)
+        return evicted
+
+    def extend(self, cells: np.ndarray) -> np.ndarray:
+        """"
+        Add a batch of cells with one ring write and return the evicted cells.
+        """
+        cells = np.asarray(cells, dtype=np.int64).reshape((-1,))
+        assert cells.shape[0] <= self.capacity, 'Batch is larger than the window.'
+        idx = (self.next_idx + np.arange(cells.shape[0])) % self.capacity
+        num_evicted = max(self.num_stored + cells.shape[0] - self.capacity, 0)
+        evicted = self.cells[idx[cells.shape[0] - num_evicted:]]  # Fancy indexing copies them before the write
+        self.cells[idx] = cells
+        self.next_idx = (self.next_idx + cells.shape[0]) % self.capacity
+        self.num_stored = min(self.num_stored + cells.shape[0], self.capacity)
+        return evicted
+
+    def window(self) -> np.ndarray:
+        """"
+        Copy of the cells in the window, oldest first.
+        """
+        if self.num_stored < self.capacity:
+            return self.cells[:self.num_stored].copy()
+        return np.concatenate((self.cells[self.next_idx:], self.cells[:self.next_idx]))
+
+    def sample(self, batch_size: int) -> np.ndarray:
+        """"
+        Sample cells uniformly from the window, so cells are drawn in proportion to their visitation counts.
+        """
+        return self.cells[np.random.randint(0, self.num_stored, size=batch_size)]
+
+
+class GridInfo(dict):
+    def __init__(self, density_fn, **kwargs):
+        """"
+        Info dict that materialises the grid-sized 'density' only when it is read. Like 'counts', the density is
+        that of the visitation counts at the time it is read.
+        """
+        super().__init__(**kwargs)
+        self._density_fn = density_fn
+
+    def __missing__(self, key):
+        if key != 'density':
+            raise KeyError(key)
+        self['density'] = self._density_fn()
+        return self['density']
+
+    def __contains__(self, key):
+        return key == 'density' or super().__contains__(key)
+
+
+class GridVisitation(object):
+    """"
+    Visitation counts of the cells of a grid over a sliding window of the last history_len visits, with the
+    exploration metrics kept up to date by VisitationStats. Combined with SimpleGridWorld and VecGridWorld, which set
+    size, num_cells and num_accesible_states.
+    """
+
+    def _init_visitation(self, history_len: int):
+        self.visitation_count = np.zeros(self.size, dtype=np.int)
+        self.visited_states = np.zeros(self.size, dtype=np.int)
+        self.history_len = history_len
+        self.visitation_history = VisitationHistory(int(history_len))
+        self.visitation_stats = VisitationStats(self.num_cells, int(history_len) + 1)
+
+    def _density(self):
+        if len(self.visitation_history) > 0:
+            return self.visitation_count / len(self.visitation_history)
+        return self.visitation_count
+
+    def _exploration_info(self):
+        """"
+        Info with the exploration metrics, computed from the visitation stats instead of the whole grid.
+        The uniform distribution is 1 / num_accesible_states on every cell, like uniform_prob_map.
+        """
+        visited_sum = self.visitation_stats.visited
+        info = GridInfo(self._density,
+                        steps=self.t,
+                        counts=self.visitation_count,
+                        unique_states=visited_sum if visited_sum > 0 else 1.0)
+        # Density is counts / n, so sum |p - counts / n| = sum |n * p - counts| / n
+        n = max(len(self.visitation_history), 1)
+        info['uniform_diff'] = self.visitation_stats.abs_diff_sum(n / self.num_accesible_states) / n
+        info['uniform_diff_visited'] = self.visitation_stats.abs_diff_sum(n / info['unique_states'], 1) / n
+        return info
+
+    def _change_count(self, cell: int, delta: int):
+        old = int(self.visitation_count.flat[cell])
+        self.visitation_count.flat[cell] = old + delta
+        self.visited_states.flat[cell] = old + delta > 0
+        self.visitation_stats.change(old, old + delta)
+
+    def _change_counts(self, cells: np.ndarray, deltas: np.ndarray):
+        """"
+        Batched _change_count of distinct cells.
+        """
+        old = self.visitation_count.flat[cells]
+        self.visitation_count.flat[cells] = old + deltas
+        self.visited_states.flat[cells] = old + deltas > 0
+        self.visitation_stats.change_batch(old, old + deltas)
+
+
+class SimpleGridWorld(GridVisitation, gym.Env):
     metadata = {'render.modes': ['human', 'agent']}
+    wraps = True
 
-    def __init__(self, size: tuple, **kwargs):
+    def __init__(self, size: tuple, obs_mode: str = 'onehot', **kwargs):
         """"
         Actions are given as indices. 0 is stay still, indices 1 and 2
         are -1 and +1 in dim 0 (left and right), indices 2 and 3 are
         -1 and +1 in dim 1 (up and down).
+        Observations are a new one-hot grid per step with obs_mode 'onehot', the integer cell id with 'index' and a
+        read-only row of the shared identity matrix with 'view', so the last two allocate nothing per step.
         """
         self.n_dims = len(size)
         if self.n_dims < 1:
             raise ValueError('Number of dimensions should be larger than zero.')
+        if obs_mode not in OBS_MODES:
+            raise ValueError(f'Unknown observation mode {obs_mode}, should be one of {OBS_MODES}.')
         self.size = size
-        self.observation_space = spaces.MultiBinary(n=int(np.prod(size)))
+        self.obs_mode = obs_mode
+        self.num_cells = int(np.prod(size))
+        self.observation_space = spaces.MultiBinary(n=self.num_cells)
+        if obs_mode == 'index':
+            self.observation_space = spaces.Discrete(self.num_cells)
         self.action_space = spaces.Discrete(self.n_dims * 2 + 1)
         self.pos = None
         self.start_pos = [self.size[i] // 2 for i in range(self.n_dims)]
         self.last_state = None
-        self.visitation_count = np.zeros(self.size, dtype=np.int)
-        self.visited_states = np.zeros(self.size, dtype=np.int)
         self.t = 0
-        self.history_len = np.prod(size) * 20
-        self.visitation_history = []
+        self._init_visitation(np.prod(size) * 20)
+        self.strides = [int(np.prod(size[i + 1:])) for i in range(self.n_dims)]
         self.num_accesible_states = np.prod(self.size)
         self.uniform_prob_map = np.ones(self.size) / self.num_accesible_states
 
     def _create_info_dict(self):
-        info = {'steps': self.t,
-                'distance': abs(self.pos[0] - self.start_pos[0]) + abs(self.pos[1] - self.start_pos[1]),
-                'counts': self.visitation_count,
-                'density': self.visitation_count / len(self.visitation_history)
-                if len(self.visitation_history) > 0 else self.visitation_count}
-        # Count of unique states visited
-        self.visited_states = (self.visitation_count > 0)
-        visited_sum = self.visited_states.sum()
+        info = self._exploration_info()
+        info['distance'] = abs(self.pos[0] - self.start_pos[0]) + abs(self.pos[1] - self.start_pos[1])
         # info['visited_states'] = np.array(self.get_unique_visited_states())
-        info['unique_states'] = visited_sum if visited_sum > 0.0 else 1.0
-        info['uniform_diff'] = np.abs(self.uniform_prob_map - info['density']).sum()
-        info['uniform_diff_visited'] = (np.abs(self.visited_states / info['unique_states']
-                                               - info['density']) * self.visited_states).sum()
         return info
 
     def step(self, a: int):
@@ -60,26 +276,49 @@ class SimpleGridWorld(gym.Env):
                 self.pos[dim] = (self.pos[dim] - 1) % self.size[dim]
             else:
                 self.pos[dim] = (self.pos[dim] + 1) % self.size[dim]
-        s = self._index_to_grid(self.pos).reshape((-1,))
+        s = self._observation(self.pos)
         self.last_state = s
         self.update_visitation_counts()
         return s, info['uniform_diff'], False, info
 
+    def _cell(self, pos) -> int:
+        return sum(p * stride for p, stride in zip(pos, self.strides))
+
     def update_visitation_counts(self):
-        self.visitation_count[tuple(self.pos)] += 1
-        self.visitation_history.append(copy.copy(self.pos))
-        if len(self.visitation_history) > self.history_len:
-            pos = self.visitation_history.pop(0)
-            self.visitation_count[tuple(pos)] -= 1
-            assert self.visitation_count[tuple(pos)] >= 0, self.visitation_count
+        cell = self._cell(self.pos)
+        self._change_count(cell, 1)
+        evicted = self.visitation_history.add(cell)
+        if evicted >= 0:
+            assert self.visitation_count.flat[evicted] > 0, self.visitation_count
+            self._change_count(evicted, -1)
+
+    def cells_to_states(self, cells: np.ndarray) -> np.ndarray:
+        """"
+        Dense observations of a batch of cell ids, e.g. of a batch of 'index' mode observations.
+        """
+        return one_hot_cells(cells, self.num_cells)
+
+    def sample_states(self, batch_size: int) -> np.ndarray:
+        """"
+        Sample states from the visitation window, like ReplayBuffer.sample_states. This lets the env itself be the
+        pool of visited negative samples of a contrastive encoder.
+        """
+        return self.cells_to_states(self.visitation_history.sample(batch_size))
 
     def reset(self):
         self.t = 0
         self.pos = copy.copy(self.start_pos)
-        s = self._index_to_grid(self.pos)
+        s = self._observation(self.pos)
         self.last_state = s
         self.update_visitation_counts()
-        return s.reshape((-1,))
+        return s
+
+    def _observation(self, pos):
+        if self.obs_mode == 'index':
+            return self._cell(pos)
+        if self.obs_mode == 'view':
+            return shared_identity(self.num_cells)[self._cell(pos)]
+        return self._index_to_grid(pos).reshape((-1,))
 
     def _index_to_grid(self, pos):
         s = np.zeros(self.size)
@@ -92,70 +331,69 @@ class SimpleGridWorld(gym.Env):
         elif mode == 'agent':
             print(self.last_state)
 
-    def get_states(self):
-        states = []
-        size = np.prod(self.size)
-        for i in range(int(size)):
-            s = np.zeros((size,))
-            s[i] = 1
-            states.append(s)
-        return states
-
-    def get_states_with_neighbours(self):
-        states = []
-        neighbours = []
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                neigh = []
-                # If self is neighbour (due to wall), that neighbour is omitted
-                # if i > 0:
-                neigh.append(self._index_to_grid([(i - 1)%self.size[0], j]).reshape((-1,)))
-                # if i < self.size[0] - 1:
-                neigh.append(self._index_to_grid([(i + 1)%self.size[0], j]).reshape((-1,)))
-                # if j > 0:
-                neigh.append(self._index_to_grid([i, (j - 1)%self.size[1]]).reshape((-1,)))
-                # if j < self.size[1] - 1:
-                neigh.append(self._index_to_grid([i, (j + 1)%self.size[1]]).reshape((-1,)))
-                neighbours.append(np.array(neigh))
-                s = self._index_to_grid([i, j]).reshape((-1,))
-                states.append(s)
-        return states, neighbours
-
-    def get_unique_visited_states(self):
-        states = []
-        size = np.prod(self.size)
-        visited = self.visited_states.reshape((-1,))
-        for i in range(int(size)):
-            if visited[i] == 0:
-                continue
-            s = np.zeros((size,))
-            s[i] = 1
-            states.append(s)
-        return np.array(states)
-
-    def get_visited_states(self):
-        states = []
-        size = np.prod(self.size)
-        count = self.visitation_count.reshape((-1,))
-        visited = self.visited_states.reshape((-1,))
-        for i in range(int(size)):
-            if visited[i] == 1:
-                continue
-            for _ in range(int(count[i])):
-                s = np.zeros((size,))
-                s[i] = 1
-                states.append(s)
-        return states
+    def get_state_cells(self) -> np.ndarray:
+        """"
+        Flat cell ids of all states, in the order get_states returns them.
+        """
+        return np.arange(self.num_cells)
+
+    def get_states(self) -> np.ndarray:
+        return self.cells_to_states(self.get_state_cells())
+
+    def get_neighbour_indices(self) -> tuple:
+        """"
+        Cell ids of all states and a [num_states, 2 * n_dims] array with, per state, the indices into those states of
+        its -1 and +1 neighbours along every dimension. The grid wraps around, in GridWorldLoad a neighbour that is a
+        wall or off the grid is -1.
+        """
+        cells = self.get_state_cells()
+        pos = np.stack(np.unravel_index(cells, self.size), axis=1)
+        state_of_cell = np.full(self.num_cells, -1, dtype=np.int64)
+        state_of_cell[cells] = np.arange(cells.shape[0])
+        size = np.array(self.size)
+        neighbours = np.full((cells.shape[0], 2 * self.n_dims), -1, dtype=np.int64)
+        for dim in range(self.n_dims):
+            for k, move in enumerate((-1, 1)):
+                neigh_pos = pos.copy()
+                neigh_pos[:, dim] += move
+                if self.wraps:
+                    neigh_pos %= size
+                in_grid = ((neigh_pos >= 0) & (neigh_pos < size)).all(axis=1)
+                neigh_cells = np.ravel_multi_index(tuple(neigh_pos[in_grid].T), self.size)
+                neighbours[in_grid, 2 * dim + k] = state_of_cell[neigh_cells]
+        return cells, neighbours
+
+    def get_states_with_neighbours(self) -> tuple:
+        """"
+        All states and, per state, the array of its neighbouring states. Neighbours that are walls are omitted.
+        """
+        cells, neighbours = self.get_neighbour_indices()
+        states = self.cells_to_states(cells)
+        return states, [states[idx[idx >= 0]] for idx in neighbours]
+
+    def get_unique_visited_states(self) -> np.ndarray:
+        return self.cells_to_states(np.flatnonzero(self.visitation_count.reshape((-1,)) > 0))
+
+    def get_visited_states(self) -> tuple:
+        """"
+        Unique states in the visitation window and their visitation counts, to be used as sampling weights.
+        """
+        cells = np.flatnonzero(self.visitation_count.reshape((-1,)) > 0)
+        return self.cells_to_states(cells), self.visitation_count.reshape((-1,))[cells]
 
 
 class GridWorldRandFeatures(SimpleGridWorld):
     def __init__(self, size: tuple, **kwargs):
         print('Random Feature Gridworld!')
+        assert kwargs.get('obs_mode', 'onehot') == 'onehot', 'Random feature observations have no other modes.'
         super().__init__(size=size, **kwargs)
         self.feature_size = np.prod(size)
         self.state_features = np.random.uniform(low=0.0, high=1.0, size=(*size, self.feature_size)).round()
         self.observation_space = spaces.MultiBinary(n=int(self.feature_size))
 
+    def cells_to_states(self, cells: np.ndarray) -> np.ndarray:
+        return self.state_features.reshape((-1, self.feature_size))[cells]
+
     def reset(self):
         self.t = 0
         self.pos = copy.copy(self.start_pos)
@@ -181,54 +419,12 @@ class GridWorldRandFeatures(SimpleGridWorld):
         self.update_visitation_counts()
         return s, info['uniform_diff'], False, info
 
-    def get_states(self):
-        states = []
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                s = self.state_features[i, j]
-                states.append(s)
-        return states
-
-    def get_states_with_neighbours(self):
-        states = []
-        neighbours = []
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                neigh = []
-                # If self is neighbour (due to wall), that neighbour is omitted
-                # if i > 0:
-                neigh.append(self.state_features[(i - 1)%self.size[0], j])
-                # if i < self.size[0] - 1:
-                neigh.append(self.state_features[(i + 1)%self.size[0], j])
-                # if j > 0:
-                neigh.append(self.state_features[i, (j - 1)%self.size[1]])
-                # if j < self.size[1] - 1:
-                neigh.append(self.state_features[i, (j + 1)%self.size[1]])
-                neighbours.append(np.array(neigh))
-                assert len(neighbours[-1].shape) == 2
-                assert neighbours[-1].shape[0] == 4
-                assert neighbours[-1].shape[1] == self.feature_size
-                s = self.state_features[i, j]
-                assert s.shape[0] == self.feature_size
-                assert len(s.shape) == 1
-                states.append(s)
-        return states, neighbours
-
-    def get_visited_states(self):
-        states = []
-        count = self.visitation_count.reshape((-1,))
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                if self.visited_states[i, j] == 1:
-                    continue
-                for _ in range(int(count[i])):
-                    s = self.state_features[i, j]
-                    states.append(s)
-        return states
-
 
 class GridWorldSubspaces(SimpleGridWorld):
+    wraps = False
+
     def __init__(self, size: tuple, **kwargs):
+        assert kwargs.get('obs_mode', 'onehot') == 'onehot', 'Subspace feature observations have no other modes.'
         super().__init__(size=size, **kwargs)
         self.subspace_size = (10, 10)
         self.subspace_feature_length = 10
@@ -246,19 +442,7 @@ class GridWorldSubspaces(SimpleGridWorld):
         return s.reshape((-1,))
 
     def _create_info_dict(self):
-        info = {'steps': self.t,
-                'counts': self.visitation_count,
-                'density': self.visitation_count / len(self.visitation_history)
-                if len(self.visitation_history) > 0 else self.visitation_count}
-        # Count of unique states visited
-        self.visited_states = (self.visitation_count > 0)
-        visited_sum = self.visited_states.sum()
-        info['unique_states'] = visited_sum if visited_sum > 0.0 else 1.0
-        # Policy-Uniform difference
-        info['uniform_diff'] = np.abs(self.uniform_prob_map - info['density']).sum()
-        info['uniform_diff_visited'] = (np.abs(self.visited_states / info['unique_states']
-                                               - info['density']) * self.visited_states).sum()
-        return info
+        return self._exploration_info()
 
     def step(self, a):
         self.t += 1
@@ -293,39 +477,25 @@ class GridWorldSubspaces(SimpleGridWorld):
         feature = self.subspace_features[pos[0], pos[1], :]
         return feature
 
-    def get_states(self):
-        states = []
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                pos = [i, j]
-                s = np.concatenate((self._superspace_feature(pos), self._subspace_feature(pos)))
-                states.append(s)
-        return states
+    def cells_to_states(self, cells: np.ndarray) -> np.ndarray:
+        positions = np.stack(np.unravel_index(cells, self.size), axis=1)
+        return np.array([np.concatenate((self._superspace_feature(pos), self._subspace_feature(pos)))
+                         for pos in positions])
 
 
 class GridWorldLoad(SimpleGridWorld):
+    wraps = False
+
     def __init__(self, map_path: str = 'maps/Box.txt', **kwargs):
         self.map = self.load_map(map_path)
-        super().__init__(tuple(self.map.shape))
+        super().__init__(tuple(self.map.shape), **kwargs)
         # Uniform visitation probability for accessible positions
         self.accesible_states = (self.map == 0)
         self.num_accesible_states = self.accesible_states.sum()
         self.uniform_prob_map = np.ones(self.size) / self.num_accesible_states
 
     def _create_info_dict(self):
-        info = {'steps': self.t,
-                'counts': self.visitation_count,
-                'density': self.visitation_count / len(self.visitation_history)
-                if len(self.visitation_history) > 0 else self.visitation_count}
-        # Count of unique states visited
-        self.visited_states = (self.visitation_count > 0).astype(np.float)
-        visited_sum = self.visited_states.sum()
-        info['unique_states'] = visited_sum if visited_sum > 0.0 else 1.0
-        # Policy-Uniform difference
-        info['uniform_diff'] = np.abs(self.uniform_prob_map - info['density']).sum()
-        info['uniform_diff_visited'] = (np.abs(self.visited_states / info['unique_states']
-                                               - info['density']) * self.visited_states).sum()
-        return info
+        return self._exploration_info()
 
     def step(self, a):
         self.t += 1
@@ -339,7 +509,7 @@ class GridWorldLoad(SimpleGridWorld):
                     self.pos[dim] -= 1
                 else:
                     self.pos[dim] += 1
-        s = self._index_to_grid(self.pos).reshape((-1,))
+        s = self._observation(self.pos)
         self.last_state = s
         self.update_visitation_counts()
         return s, info['uniform_diff'], False, info
@@ -384,80 +554,136 @@ class GridWorldLoad(SimpleGridWorld):
                         raise ValueError(f'Invalid character {c} at: row {x}, column {y}.')
         return map
 
-    def get_states(self):
-        states = []
-        size = np.prod(self.size)
-        map1D = self.map.reshape((-1,))
-        for i in range(int(size)):
-            if map1D[i] == 1:
-                continue
-            s = np.zeros((size,))
-            s[i] = 1
-            states.append(s)
-        return states
-
-    def get_unique_visited_states(self):
-        states = []
-        size = np.prod(self.size)
-        visited = self.visited_states.reshape((-1,))
-        for i in range(int(size)):
-            if visited[i] == 1:
-                continue
-            s = np.zeros((size,))
-            s[i] = 1
-            states.append(s)
-        return states
-
-    def get_visited_states(self):
-        states = []
-        size = np.prod(self.size)
-        count = self.visitation_count.reshape((-1,))
-        visited = self.visited_states.reshape((-1,))
-        for i in range(int(size)):
-            if visited[i] == 1:
-                continue
-            for _ in range(int(count[i])):
-                s = np.zeros((size,))
-                s[i] = 1
-                states.append(s)
-        return states
-
-    def get_states_with_neighbours(self):
-        states = []
-        neighbours = []
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                if not self.accesible_states[i, j]:  # If grid element is a wall, skip
-                    continue
-                neigh = []
-                # If self is neighbour (due to wall), that neighbour is omitted
-                if i - 1 >= 0 and self.accesible_states[i - 1, j]:
-                    neigh.append(self._index_to_grid([i - 1, j]).reshape((-1,)))
-                if i + 1 < self.size[0] and self.accesible_states[i + 1, j]:
-                    neigh.append(self._index_to_grid([i + 1, j]).reshape((-1,)))
-                if j - 1 >= 0 and self.accesible_states[i, j - 1]:
-                    neigh.append(self._index_to_grid([i, j - 1]).reshape((-1,)))
-                if j + 1 < self.size[1] and self.accesible_states[i, j + 1]:
-                    neigh.append(self._index_to_grid([i, j + 1]).reshape((-1,)))
-                neighbours.append(np.array(neigh))
-                s = self._index_to_grid([i, j]).reshape((-1,))
-                states.append(s)
-        return states, neighbours
+    def get_state_cells(self) -> np.ndarray:
+        return np.flatnonzero(self.map.reshape((-1,)) == 0)
+
+
+class VecGridWorld(GridVisitation, gym.Env):
+    metadata = {'render.modes': ['human']}
+
+    def __init__(self, size: tuple = None, map_path: str = None, num_envs: int = 64, max_episode_steps: int = None,
+                 obs_mode: str = 'onehot', **kwargs):
+        """"
+        Steps num_envs agents at once, with the positions of all agents kept in one [num_envs, n_dims] integer array.
+        Without a map the grid wraps around like SimpleGridWorld, with a map (see GridWorldLoad) moves into walls or
+        off the grid are blocked. Actions are indices as in SimpleGridWorld, step takes one action per agent and
+        returns a [num_envs, prod(size)] batch of one-hot observations, or the [num_envs] cell ids with obs_mode 'index'.
+        Agents whose episode is done are not reset by step, reset them with reset(indices).
+        The visitation window of the last prod(size) * 20 visits (at least num_envs) and the exploration metrics derived
+        from it are shared by all agents, they are those of SimpleGridWorld and GridWorldLoad applied to the visits of
+        every agent.
+        """
+        self.map = None
+        if map_path is not None:
+            self.map = GridWorldLoad.load_map(map_path)
+            size = tuple(self.map.shape)
+        self.n_dims = len(size)
+        if self.n_dims < 1:
+            raise ValueError('Number of dimensions should be larger than zero.')
+        if obs_mode not in ('onehot', 'index'):
+            raise ValueError(f'Unknown observation mode {obs_mode}, should be onehot or index.')
+        self.size = size
+        self.obs_mode = obs_mode
+        self.num_cells = int(np.prod(size))
+        self.num_envs = num_envs
+        self.max_episode_steps = max_episode_steps
+        self.observation_space = spaces.MultiBinary(n=self.num_cells)
+        if obs_mode == 'index':
+            self.observation_space = spaces.Discrete(self.num_cells)
+        self.action_space = spaces.Discrete(self.n_dims * 2 + 1)
+        # Row a is the move of action a: 0 stays still, 2 * dim + 1 is -1 and 2 * dim + 2 is +1 along dim
+        self.moves = np.zeros((self.n_dims * 2 + 1, self.n_dims), dtype=np.int64)
+        for dim in range(self.n_dims):
+            self.moves[2 * dim + 1, dim] = -1
+            self.moves[2 * dim + 2, dim] = 1
+        self.start_pos = np.array([self.size[i] // 2 for i in range(self.n_dims)], dtype=np.int64)
+        self.pos = np.tile(self.start_pos, (num_envs, 1))
+        self.t = np.zeros(num_envs, dtype=np.int64)
+        self._init_visitation(max(self.num_cells * 20, num_envs))
+        if self.map is not None:
+            self.num_accesible_states = (self.map == 0).sum()
+        else:
+            self.num_accesible_states = np.prod(self.size)
+        self.uniform_prob_map = np.ones(self.size) / self.num_accesible_states
+
+    def _flat_pos(self, pos):
+        return np.ravel_multi_index(tuple(pos.T), self.size)
+
+    def _observations(self, pos):
+        if self.obs_mode == 'index':
+            return self._flat_pos(pos)
+        return one_hot_cells(self._flat_pos(pos), self.num_cells)
+
+    def cells_to_states(self, cells: np.ndarray) -> np.ndarray:
+        return one_hot_cells(cells, self.num_cells)
+
+    def _create_info_dict(self):
+        info = self._exploration_info()
+        info['steps'] = self.t.copy()
+        return info
+
+    def update_visitation_counts(self, pos):
+        added = self._flat_pos(pos)
+        evicted = self.visitation_history.extend(added)
+        cells, inverse = np.unique(np.concatenate((added, evicted)), return_inverse=True)
+        signs = np.concatenate((np.ones(len(added), dtype=np.int64), -np.ones(len(evicted), dtype=np.int64)))
+        deltas = np.bincount(inverse.reshape((-1,)), weights=signs, minlength=len(cells)).astype(np.int64)
+        self._change_counts(cells[deltas != 0], deltas[deltas != 0])
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int64).reshape((-1,))
+        assert actions.shape[0] == self.num_envs, f'Expected {self.num_envs} actions, got {actions.shape[0]}'
+        assert ((0 <= actions) & (actions < self.n_dims * 2 + 1)).all(), \
+            f'Invalid action: 0 <= a < {self.n_dims * 2 + 1}'
+        self.t += 1
+        new_pos = self.pos + self.moves[actions]
+        if self.map is None:
+            new_pos %= np.array(self.size, dtype=np.int64)
+        else:
+            in_grid = ((new_pos >= 0) & (new_pos < np.array(self.size))).all(axis=1)
+            clipped = np.clip(new_pos, 0, np.array(self.size) - 1)
+            blocked = ~in_grid | (self.map[tuple(clipped.T)] == 1)
+            new_pos[blocked] = self.pos[blocked]
+        self.pos = new_pos
+        self.update_visitation_counts(self.pos)
+        info = self._create_info_dict()
+        if self.max_episode_steps is not None:
+            done = self.t >= self.max_episode_steps
+        else:
+            done = np.zeros(self.num_envs, dtype=bool)
+        r = np.full(self.num_envs, info['uniform_diff'])
+        return self._observations(self.pos), r, done, info
+
+    def reset(self, indices=None):
+        """"
+        Reset the agents at indices, or all agents if no indices are given, and return the observations of all agents.
+        """
+        if indices is None:
+            indices = np.arange(self.num_envs)
+        indices = np.asarray(indices, dtype=np.int64).reshape((-1,))
+        self.pos[indices] = self.start_pos
+        self.t[indices] = 0
+        self.update_visitation_counts(self.pos[indices])
+        return self._observations(self.pos)
+
+    def render(self, mode='human'):
+        if mode == 'human':
+            print(self.pos)
 
 
 class GridWorld10x10(SimpleGridWorld):
-    def __init__(self):
-        super(GridWorld10x10, self).__init__(size=(10, 10))
+    def __init__(self, **kwargs):
+        super(GridWorld10x10, self).__init__(size=(10, 10), **kwargs)
 
 
 class GridWorld25x25(SimpleGridWorld):
-    def __init__(self):
-        super(GridWorld25x25, self).__init__(size=(25, 25))
+    def __init__(self, **kwargs):
+        super(GridWorld25x25, self).__init__(size=(25, 25), **kwargs)
 
 
 class GridWorld42x42(SimpleGridWorld):
-    def __init__(self):
-        super(GridWorld42x42, self).__init__(size=(42, 42))
+    def __init__(self, **kwargs):
+        super(GridWorld42x42, self).__init__(size=(42, 42), **kwargs)
 
 
 class GridWorldRandFeatures42x42(GridWorldRandFeatures):
@@ -471,15 +697,39 @@ class GridWorldSubspace50x50(GridWorldSubspaces):
 
 
 class GridWorldBox11x11(GridWorldLoad):
-    def __init__(self):
-        super(GridWorldBox11x11, self).__init__(map_path='maps/Box.txt')
+    def __init__(self, **kwargs):
+        super(GridWorldBox11x11, self).__init__(map_path='maps/Box.txt', **kwargs)
 
 
 class GridWorldSpiral28x28(GridWorldLoad):
-    def __init__(self):
-        super(GridWorldSpiral28x28, self).__init__(map_path='maps/Spiral.txt')
+    def __init__(self, **kwargs):
+        super(GridWorldSpiral28x28, self).__init__(map_path='maps/Spiral.txt', **kwargs)
 
 
 class GridWorldSpiral52x50(GridWorldLoad):
-    def __init__(self):
-        super(GridWorldSpiral52x50, self).__init__(map_path='maps/Spiral_large.txt')
+    def __init__(self, **kwargs):
+        super(GridWorldSpiral52x50, self).__init__(map_path='maps/Spiral_large.txt', **kwargs)
+
+
+class GridWorld42x42Vec(VecGridWorld):
+    def __init__(self, num_envs=64, **kwargs):
+        super(GridWorld42x42Vec, self).__init__(size=(42, 42), num_envs=num_envs, max_episode_steps=42*2,
+                                                **kwargs)
+
+
+class GridWorldBox11x11Vec(VecGridWorld):
+    def __init__(self, num_envs=64, **kwargs):
+        super(GridWorldBox11x11Vec, self).__init__(map_path='maps/Box.txt', num_envs=num_envs,
+                                                   max_episode_steps=11*10, **kwargs)
+
+
+class GridWorldSpiral28x28Vec(VecGridWorld):
+    def __init__(self, num_envs=64, **kwargs):
+        super(GridWorldSpiral28x28Vec, self).__init__(map_path='maps/Spiral.txt', num_envs=num_envs,
+                                                      max_episode_steps=28*28, **kwargs)
+
+
+class GridWorldSpiral52x50Vec(VecGridWorld):
+    def __init__(self, num_envs=64, **kwargs):
+        super(GridWorldSpiral52x50Vec, self).__init__(map_path='maps/Spiral_large.txt', num_envs=num_envs,
+                                                      max_episode_steps=52*50, **kwargs)
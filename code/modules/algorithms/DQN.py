@@ -3,6 +3,8 @@ import numpy as np
 import copy
 import math
 from modules.algorithms.network import Network1D, Network2D
+from modules.target_network import soft_update, hard_update
+from modules.loss_logging import LossStats, LossAccumulator
 import os
 
 class DQN:
@@ -32,10 +34,12 @@ class DQN:
         self.optimizer = torch.optim.Adam(self.network.parameters(), lr=kwargs['alg_lr'])
         self.soft_target = kwargs['alg_soft_target']
         self.target_network_steps = kwargs['alg_target_net_steps']
+        self.tau = kwargs['alg_tau']
         self.target_network = None
         if self.soft_target or self.target_network_steps != 0:
             self.target_network = copy.deepcopy(self.network).to(device)
-        self.losses = []
+        self.losses = LossStats()
+        self.loss_log = LossAccumulator({'alg_loss': self.losses}, flush_interval=kwargs['export_interval'])
         self.train_steps = 0
         print('DQN Architecture:')
         print(self.network)
@@ -57,6 +61,15 @@ class DQN:
                 batch_size = s_t.shape[0]
             return torch.randint(self.a_dim[0], (batch_size,))
 
+    def flush_losses(self):
+        # type: () -> LossStats
+        """"
+        Move the losses still pending on the device into self.losses. Forces a host-device sync, so it is only called
+        when the losses are exported.
+        """
+        self.loss_log.flush()
+        return self.losses
+
     def train(self, s_t, a_t, r_t, s_tp1, d_t):
         # type: (torch.Tensor, torch.LongTensor, torch.Tensor, torch.Tensor, torch.IntTensor) -> None
         """"
@@ -86,7 +99,7 @@ class DQN:
         torch.nn.utils.clip_grad_norm_(self.network.parameters(), 1.0)
         self.optimizer.step()
 
-        self.losses.append(loss.item())
+        self.loss_log.append('alg_loss', loss.detach())
         self.train_steps += 1
         self.update_target_network()
         self.update_epsilon()
@@ -108,12 +121,11 @@ class DQN:
     def update_target_network(self):
         if self.target_network is not None:
             if self.soft_target:
-                for target_param, param in zip(self.target_network.parameters(), self.network.parameters()):
-                    target_param.data.copy_(target_param.data * (1.0 - 0.01) + param.data * 0.01)
+                soft_update(self.target_network, self.network, self.tau)
             else:
                 assert self.target_network_steps != 0
                 if self.train_steps % self.target_network_steps == 0:
-                    self.target_network = copy.deepcopy(self.network)
+                    hard_update(self.target_network, self.network)
         else:
             assert not self.soft_target or self.target_network_steps == 0
 
@@ -128,7 +140,7 @@ class DQN:
         torch.save({'train_steps': self.train_steps,
                     'network': self.network,
                     'optimizer': self.optimizer,
-                    'losses': self.losses
+                    'losses': self.flush_losses().state_dict()
                     }, folder_path + 'DQN_items.pt')
 
     def load(self, path):
@@ -136,7 +148,7 @@ class DQN:
         self.train_steps = checkpoint['train_steps']
         self.network = checkpoint['network']
         self.optimizer = checkpoint['optimizer']
-        self.losses = checkpoint['losses']
+        self.losses.load_state_dict(checkpoint['losses'])
 
 
 class TabularQlearning:
@@ -148,7 +160,7 @@ class TabularQlearning:
         self.gamma = gamma
         self.epsilon = epsilon
         self.train_steps = 0
-        self.losses = []
+        self.losses = LossStats()
 
     def act(self, s_t, eval=False, eps=None):
         # type: (np.ndarray, bool, float) -> int
@@ -198,11 +210,11 @@ class TabularQlearning:
 
     def save(self, path='saved_objects/dqn_items.pt'):
         torch.save({'train_steps': self.train_steps,
-                    'losses': self.losses
+                    'losses': self.losses.state_dict()
                     }, path)
 
     def load(self, path):
         checkpoint = torch.load(path)
         self.train_steps = checkpoint['train_steps']
-        self.losses = checkpoint['losses']
+        self.losses.load_state_dict(checkpoint['losses'])
 
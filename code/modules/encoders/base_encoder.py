@@ -41,3 +41,20 @@ class BaseEncoder(nn.Module):
 
     def get_x_dim(self) -> tuple:
         return self.x_dim
+
+    def uses_batch_statistics(self) -> bool:
+        return self.training and any(isinstance(m, nn.modules.batchnorm._BatchNorm) for m in self.modules())
+
+    def forward_pair(self, x_t: torch.Tensor, x_tp1: torch.Tensor) -> tuple:
+        """"
+        Encode two batches with a single forward pass over their concatenation. Batch norm layers in training mode
+        normalize with the statistics of the batch they receive, so such encoders encode both batches separately.
+        """
+        le = len(self.x_dim)
+        if len(tuple(x_t.shape)) != le + 1 or len(tuple(x_tp1.shape)) != le + 1 or self.uses_batch_statistics():
+            return self(x_t), self(x_tp1)
+        out = self(torch.cat((x_t.to(self.device), x_tp1.to(self.device))))
+        n = x_t.shape[0]
+        if isinstance(out, tuple):
+            return tuple(o[:n] for o in out), tuple(o[n:] for o in out)
+        return out[:n], out[n:]
@@ -0,0 +1,119 @@
+import math
+import numpy as np
+import torch
+
+
+class LossStats:
+    def __init__(self, window=100, ema_decay=0.99):
+        # type: (int, float) -> None
+        """"
+        Streaming statistics of a loss with fixed memory: mean over the last window values, exponential moving
+        average, min, max and count. Replaces an ever-growing list of per-step losses.
+        """
+        self.ema_decay = ema_decay
+        self.window = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.ema = math.nan
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        # type: (object) -> None
+        value = float(value)
+        self.window[self.count % self.window.shape[0]] = value
+        self.count += 1
+        self.ema = value if self.count == 1 else self.ema_decay * self.ema + (1.0 - self.ema_decay) * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def extend(self, values):
+        # type: (list) -> None
+        for value in values:
+            self.append(value)
+
+    def mean(self):
+        # type: () -> float
+        """"
+        Mean over the last window values, nan when nothing was appended yet.
+        """
+        if self.count == 0:
+            return math.nan
+        return float(self.window[:min(self.count, self.window.shape[0])].mean())
+
+    def state_dict(self):
+        # type: () -> dict
+        return {'window': self.window.tolist(), 'ema_decay': self.ema_decay, 'count': self.count,
+                'ema': self.ema, 'min': self.min, 'max': self.max}
+
+    def load_state_dict(self, state):
+        # type: (dict) -> None
+        self.window = np.array(state['window'], dtype=np.float64)
+        self.ema_decay = state['ema_decay']
+        self.count = state['count']
+        self.ema = state['ema']
+        self.min = state['min']
+        self.max = state['max']
+
+
+def make_losses(keys, window=100):
+    # type: (tuple, int) -> dict
+    return {key: LossStats(window) for key in keys}
+
+
+def losses_state_dict(losses):
+    # type: (dict) -> dict
+    return {key: stats.state_dict() for key, stats in losses.items()}
+
+
+def load_losses(state):
+    # type: (dict) -> dict
+    losses = {}
+    for key in state:
+        losses[key] = LossStats()
+        losses[key].load_state_dict(state[key])
+    return losses
+
+
+class LossAccumulator:
+    def __init__(self, losses, flush_interval=500):
+        # type: (dict, int) -> None
+        """"
+        Keeps loss values that are still tensors on the device and only converts them to floats when flushed, so
+        logging a loss does not force a host-device sync on every training step. All keys are flushed together once
+        one of them holds flush_interval values, i.e. every flush_interval training steps.
+        Flushed values are appended to the LossStats in losses, which is what readers of the losses see.
+        """
+        self.losses = losses
+        self.flush_interval = flush_interval
+        self._pending = {}
+
+    def append(self, key, value):
+        # type: (str, object) -> None
+        if isinstance(value, torch.Tensor):
+            pending = self._pending.setdefault(key, [])
+            pending.append(value.detach().reshape(()))
+            if len(pending) >= self.flush_interval:
+                self.flush()
+        else:
+            self.flush_key(key)
+            self.losses[key].append(value)
+
+    def update(self, loss_items):
+        # type: (dict) -> None
+        for key in loss_items:
+            self.append(key, loss_items[key])
+
+    def flush_key(self, key):
+        # type: (str) -> None
+        values = self._pending.pop(key, [])
+        if len(values) > 0:
+            self.losses[key].extend(torch.stack(values).float().cpu().tolist())
+
+    def flush(self):
+        # type: () -> dict
+        for key in list(self._pending.keys()):
+            self.flush_key(key)
+        return self.losses
@@ -0,0 +1,96 @@
+import threading
+import queue
+
+
+class BatchPrefetcher(object):
+    def __init__(self, buffer, batch_size, collate_fn, queue_size=2, pin_memory=False):
+        """Sample batches from a replay buffer in a background thread and keep a bounded
+        queue of ready-made torch batches, so sampling and conversion overlap with
+        environment steps and gradient computation. NumPy indexing and torch copies release
+        the GIL, which lets the worker run alongside the training loop.
+
+        While the prefetcher runs, transitions must be added through prefetcher.add so that
+        writes to the buffer never interleave with the worker's reads of it. Queued batches
+        are at most queue_size batches older than the buffer.
+
+        Parameters
+        ----------
+        buffer: ArrayBuffer
+            Replay buffer to sample from.
+        batch_size: int
+            How many transitions to sample per batch.
+        collate_fn: callable
+            Converts the sampled fields to torch tensors, e.g. transition_to_torch_no_r.
+        queue_size: int
+            Max number of batches waiting in the queue.
+        pin_memory: bool
+            Put batches in page-locked memory so they can be copied to the GPU asynchronously.
+        """
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.collate_fn = collate_fn
+        self.pin_memory = pin_memory
+        self.lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._worker, name='BatchPrefetcher', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
+
+    def _worker(self):
+        try:
+            while not self._stop.is_set():
+                with self.lock:
+                    batch = self.buffer.sample(self.batch_size)  # Fancy indexing copies the sampled data
+                batch = self.collate_fn(*batch)
+                if self.pin_memory:
+                    batch = tuple(b.pin_memory() for b in batch)
+                self._put(batch)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def add(self, *args, **kwargs):
+        """Add a transition to the buffer, see the buffer's add."""
+        with self.lock:
+            self.buffer.add(*args, **kwargs)
+
+    def get(self):
+        """Return the next prefetched batch, waiting for the worker if the queue is empty."""
+        while True:
+            if not self._thread.is_alive() and self._queue.empty():
+                raise RuntimeError('Prefetcher is closed.')
+            try:
+                batch = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+        if isinstance(batch, Exception):
+            self.close()
+            raise batch
+        return batch
+
+    def close(self):
+        """Stop the worker thread and drop all queued batches."""
+        self._stop.set()
+        self._thread.join()
+        while not self._queue.empty():
+            self._queue.get_nowait()
@@ -1,5 +1,7 @@
 import numpy as np
 import random
+import pickle
+import os
 
 from .segment_tree import SumSegmentTree, MinSegmentTree
 
@@ -186,9 +188,516 @@ class DynamicsReplayBuffer(object):
         return self._encode_sample(np.arange(len(self._storage)))
 
 
-class PrioritizedReplayBuffer(ReplayBuffer):
-    def __init__(self, size, alpha):
-        """Create Prioritized Replay buffer.
+class ArrayBuffer(object):
+    STATE_FILE = 'state.pkl'
+
+    def __init__(self, size, seed=None):
+        """Create a ring buffer which stores every field of a transition in its own
+        preallocated NumPy array. Arrays are allocated on the first call to add, using
+        the shapes and dtypes of the first transition.
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store in the buffer. When the buffer
+            overflows the old memories are dropped.
+        seed: int
+            Seed of the random generator used to sample indices.
+        """
+        self._storage = None  # Tuple of per-field arrays of shape (size, *field_shape)
+        self._arrays = {}  # All arrays of the buffer by name
+        self._intr_rewards = None  # Intrinsic rewards of the transitions, allocated when first stored
+        self._maxsize = int(size)
+        self._next_idx = 0
+        self._num_stored = 0
+        self._rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self._num_stored
+
+    def _empty(self, name, shape, dtype):
+        self._arrays[name] = np.zeros(shape, dtype=dtype)
+        return self._arrays[name]
+
+    def _bind_arrays(self):
+        """"
+        Point the buffer's attributes to the arrays in self._arrays.
+        """
+        num_fields = sum(name.startswith('field') for name in self._arrays)
+        self._storage = tuple(self._arrays[f'field{i}'] for i in range(num_fields))
+        self._intr_rewards = self._arrays.get('intr_rewards')
+
+    def _field_dtypes(self, data):
+        return [np.asarray(d).dtype for d in data]
+
+    def _allocate(self, data):
+        for i, (d, dtype) in enumerate(zip(data, self._field_dtypes(data))):
+            self._empty(f'field{i}', (self._maxsize, *np.shape(d)), dtype)
+        self._bind_arrays()
+
+    def _advance(self):
+        self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._num_stored = min(self._num_stored + 1, self._maxsize)
+
+    def _add_data(self, data):
+        if self._storage is None:
+            self._allocate(data)
+        for field, d in zip(self._storage, data):
+            field[self._next_idx] = d
+        if self._intr_rewards is not None:
+            self._intr_rewards[self._next_idx] = np.nan  # Not scored by the world model yet
+        self._advance()
+
+    def _sample_idxes(self, batch_size):
+        return self._rng.randint(0, self._num_stored, size=batch_size)
+
+    def _encode_sample(self, idxes):
+        return tuple(field[idxes] for field in self._storage)
+
+    def sample(self, batch_size):
+        """Sample a batch of experiences. Each field is gathered with a single fancy-indexing
+        operation. See ReplayBuffer.sample and DynamicsReplayBuffer.sample for the returned fields.
+
+        Parameters
+        ----------
+        batch_size: int
+            How many transitions to sample.
+        """
+        return self._encode_sample(self._sample_idxes(batch_size))
+
+    def sample_states(self, batch_size):
+        """Sample a batch of experiences.
+
+        Parameters
+        ----------
+        batch_size: int
+            How many transitions to sample.
+
+        Returns
+        -------
+        obs_batch: np.array
+            batch of observations
+        """
+        return self._storage[0][self._sample_idxes(batch_size)]
+
+    def return_all(self):
+        return self._encode_sample(np.arange(self._num_stored))
+
+    def update_intrinsic_rewards(self, rewards, idxes):
+        """"
+        Store the intrinsic rewards of the transitions at idxes with a single vectorized write. They are kept in their
+        own array, so extrinsic rewards are never overwritten. Transitions added afterwards are unscored (nan).
+        """
+        if self._intr_rewards is None:
+            self._empty('intr_rewards', (self._maxsize,), np.float32)[:] = np.nan
+            self._intr_rewards = self._arrays['intr_rewards']
+        self._intr_rewards[np.asarray(idxes)] = rewards
+
+    def sample_with_intrinsic_rewards(self, batch_size):
+        """Sample a batch of experiences together with their stored intrinsic rewards.
+
+        Parameters
+        ----------
+        batch_size: int
+            How many transitions to sample.
+
+        Returns
+        -------
+        The fields of sample, followed by the intrinsic rewards of the batch. These are nan
+        for transitions that have not been scored since they were added.
+        """
+        idxes = self._sample_idxes(batch_size)
+        if self._intr_rewards is None:
+            return self._encode_sample(idxes) + (np.full(len(idxes), np.nan, dtype=np.float32),)
+        return self._encode_sample(idxes) + (self._intr_rewards[idxes],)
+
+    def chunks(self, chunk_size):
+        """Iterate over all stored transitions in contiguous chunks without copying them.
+
+        Parameters
+        ----------
+        chunk_size: int
+            Max number of transitions per chunk.
+
+        Returns
+        -------
+        Generator of (idxes, fields) pairs, where fields holds views of every field of the
+        transitions at idxes.
+        """
+        for start in range(0, self._num_stored, chunk_size):
+            end = min(start + chunk_size, self._num_stored)
+            yield np.arange(start, end), tuple(field[start:end] for field in self._storage)
+
+    def _state(self):
+        return {'size': self._maxsize, 'next_idx': self._next_idx, 'num_stored': self._num_stored,
+                'arrays': list(self._arrays), 'rng_state': self._rng.get_state()}
+
+    def _set_state(self, state):
+        assert state['size'] == self._maxsize, f'Snapshot has size {state["size"]}, not {self._maxsize}.'
+        self._next_idx, self._num_stored = state['next_idx'], state['num_stored']
+        self._rng.set_state(state['rng_state'])
+
+    def _restore_array(self, name, snapshot):
+        if len(snapshot) == self._maxsize:
+            self._arrays[name] = snapshot  # Copy-on-write mapping, pages are only read when sampled
+        else:
+            self._empty(name, (self._maxsize, *snapshot.shape[1:]), snapshot.dtype)[:len(snapshot)] = snapshot
+
+    def save(self, folder_path):
+        """Write a snapshot of the buffer to folder_path: one .npy file per array, holding only
+        the filled slots, and a small state file with the write index, fill level and the state
+        of the sampling random generator. Files are replaced atomically, so a snapshot can be
+        saved over the one the buffer was loaded from.
+
+        Parameters
+        ----------
+        folder_path: str
+            Folder to write the snapshot to.
+        """
+        os.makedirs(folder_path, exist_ok=True)
+        for name, array in self._arrays.items():
+            file_path = os.path.join(folder_path, name + '.npy')
+            with open(file_path + '.tmp', 'wb') as f:
+                np.save(f, array[:self._num_stored])
+            os.replace(file_path + '.tmp', file_path)
+        with open(os.path.join(folder_path, self.STATE_FILE + '.tmp'), 'wb') as f:
+            pickle.dump(self._state(), f)
+        os.replace(os.path.join(folder_path, self.STATE_FILE + '.tmp'), os.path.join(folder_path, self.STATE_FILE))
+
+    def load(self, folder_path):
+        """Restore a snapshot written by save. Arrays of a full buffer are memory-mapped
+        copy-on-write instead of read, so loading is almost instant and the snapshot files are
+        never modified.
+
+        Parameters
+        ----------
+        folder_path: str
+            Folder holding the snapshot.
+        """
+        with open(os.path.join(folder_path, self.STATE_FILE), 'rb') as f:
+            state = pickle.load(f)
+        self._arrays = {}
+        for name in state['arrays']:
+            self._restore_array(name, np.load(os.path.join(folder_path, name + '.npy'), mmap_mode='c'))
+        if self._arrays:
+            self._bind_arrays()
+        self._set_state(state)
+        print(f'Loaded replay buffer from {folder_path} ({self._num_stored}/{self._maxsize} slots filled).')
+
+
+class ArrayReplayBuffer(ArrayBuffer):
+    REWARD_FIELD = 2
+
+    def add(self, obs_t, action, reward, obs_tp1, done):
+        self._add_data((obs_t, action, reward, obs_tp1, done))
+
+    def _field_dtypes(self, data):
+        dtypes = super()._field_dtypes(data)
+        dtypes[self.REWARD_FIELD] = np.float32  # First reward could be an int, later ones won't
+        return dtypes
+
+    def update_rewards(self, rewards, idxes):
+        """"
+        Replaces reward value in given transition indices with a single vectorized write.
+        """
+        assert type(rewards) == np.ndarray or type(rewards) == list
+        self._storage[self.REWARD_FIELD][np.asarray(idxes)] = rewards
+
+
+class ArrayDynamicsReplayBuffer(ArrayBuffer):
+
+    def add(self, obs_t, action, obs_tp1, done):
+        self._add_data((obs_t, action, obs_tp1, done))
+
+
+class FrameStackReplayBuffer(ArrayBuffer):
+    def __init__(self, size, frame_stack, seed=None):
+        """Create a dynamics replay buffer for frame-stacked observations (C*frame_stack, H, W)
+        which stores every frame only once. Slot i holds the newest frame of obs_t of the
+        transition stored in it, so obs_t is rebuilt from slots i-frame_stack+1..i and obs_tp1
+        from slots i-frame_stack+2..i+1. Every episode uses one extra slot for its last frame.
+        The first obs_t of an episode must be zero-padded, as stacks are on reset: only its
+        newest frame is stored and the frames preceding it are returned as zeros.
+
+        Parameters
+        ----------
+        size: int
+            Number of frame slots in the buffer, not of transitions: an episode of n
+            transitions takes n + 1 slots, and len(buffer) counts slots as well. When the
+            buffer overflows the old memories are dropped.
+        frame_stack: int
+            Number of frames stacked along the channel dimension of an observation.
+        seed: int
+            Seed of the random generator used to sample indices.
+        """
+        super().__init__(size, seed)
+        assert self._maxsize > frame_stack, 'Buffer must be able to hold more than one stack.'
+        self._frame_stack = frame_stack
+        self._frames, self._actions, self._dones = None, None, None
+        self._first = None  # Slot holds first frame of an episode
+        self._valid = None  # Slot holds the obs_t of a transition
+        self._episode_open = False  # Newest slot holds the obs_tp1 of an unfinished episode
+        # Offsets of the frame_stack + 1 slots forming an (obs_t, obs_tp1) pair
+        self._stack_offsets = np.arange(-frame_stack + 1, 2)
+
+    def _allocate(self, obs_t, action, done):
+        obs_t = np.asarray(obs_t)
+        assert obs_t.shape[0] % self._frame_stack == 0, 'Channel dim must be divisible by frame_stack.'
+        self._empty('frames', (self._maxsize, obs_t.shape[0] // self._frame_stack, *obs_t.shape[1:]), obs_t.dtype)
+        self._empty('actions', (self._maxsize, *np.shape(action)), np.asarray(action).dtype)
+        self._empty('dones', (self._maxsize,), np.asarray(done).dtype)
+        self._empty('first', (self._maxsize,), np.bool_)
+        self._empty('valid', (self._maxsize,), np.bool_)
+        self._bind_arrays()
+
+    def _bind_arrays(self):
+        self._frames, self._actions, self._dones = self._arrays['frames'], self._arrays['actions'], self._arrays['dones']
+        self._first, self._valid = self._arrays['first'], self._arrays['valid']
+        self._frame_shape = tuple(self._frames.shape[1:])
+        self._storage = (self._frames, self._actions, self._dones)
+
+    def _set_state(self, state):
+        super()._set_state(state)
+        self._episode_open = False  # Transitions added after a restore start a new episode
+
+    def _push_frame(self, frame, first):
+        idx = self._next_idx
+        self._frames[idx] = frame
+        self._first[idx] = first
+        self._valid[idx] = False
+        self._advance()
+        return idx
+
+    def add(self, obs_t, action, obs_tp1, done, new_episode=False):
+        """Add a transition. Unless new_episode is set, obs_t is taken to be the obs_tp1 of
+        the previous transition, which must not have been done.
+
+        Parameters
+        ----------
+        new_episode: bool
+            obs_t is the first, zero-padded observation of an episode. Must be set when an
+            episode is left before it is done, e.g. when filling the buffer stops mid-episode.
+        """
+        if self._frames is None:
+            self._allocate(obs_t, action, done)
+        if new_episode or not self._episode_open:
+            # Only the newest frame of obs_t is stored, the older ones are padding
+            idx = self._push_frame(np.reshape(obs_t, (self._frame_stack, *self._frame_shape))[-1], first=True)
+        else:
+            # obs_t continues the previous transition, its newest frame is already in the last slot
+            idx = (self._next_idx - 1) % self._maxsize
+        self._actions[idx] = action
+        self._dones[idx] = done
+        self._valid[idx] = True
+        self._push_frame(np.reshape(obs_tp1, (self._frame_stack, *self._frame_shape))[-1], first=False)
+        self._episode_open = not done
+
+    def _is_sampleable(self, idxes):
+        sampleable = self._valid[idxes]
+        if self._num_stored == self._maxsize:
+            # Slots right after the write position lost the older frames of their stacks
+            sampleable &= (idxes - self._next_idx) % self._maxsize >= self._frame_stack - 1
+        return sampleable
+
+    def _sample_idxes(self, batch_size):
+        assert self._valid.any(), 'Buffer contains no complete transitions.'
+        idxes = self._rng.randint(0, self._num_stored, size=batch_size)
+        rejected = ~self._is_sampleable(idxes)
+        while rejected.any():
+            idxes[rejected] = self._rng.randint(0, self._num_stored, size=rejected.sum())
+            rejected = ~self._is_sampleable(idxes)
+        return idxes
+
+    def _gather_stacks(self, idxes):
+        slots = (idxes[:, None] + self._stack_offsets[None, :]) % self._maxsize
+        frames = self._frames[slots]  # (batch, frame_stack + 1, C, H, W)
+        # A frame is padding if a later frame within obs_t starts its episode
+        first = self._first[slots[:, 1:self._frame_stack]]
+        padding = np.flip(np.logical_or.accumulate(np.flip(first, axis=1), axis=1), axis=1)
+        frames[:, :self._frame_stack - 1][padding] = 0
+        batch_size = len(idxes)
+        obs_t = frames[:, :-1].reshape((batch_size, -1, *self._frame_shape[1:]))
+        obs_tp1 = frames[:, 1:].reshape((batch_size, -1, *self._frame_shape[1:]))
+        return obs_t, obs_tp1
+
+    def _encode_sample(self, idxes):
+        obs_t, obs_tp1 = self._gather_stacks(idxes)
+        return obs_t, self._actions[idxes], obs_tp1, self._dones[idxes]
+
+    def sample_states(self, batch_size):
+        """Sample a batch of experiences.
+
+        Parameters
+        ----------
+        batch_size: int
+            How many transitions to sample.
+
+        Returns
+        -------
+        obs_batch: np.array
+            batch of observations
+        """
+        obs_t, _ = self._gather_stacks(self._sample_idxes(batch_size))
+        return obs_t
+
+    def return_all(self):
+        idxes = np.arange(self._num_stored)
+        return self._encode_sample(idxes[self._is_sampleable(idxes)])
+
+
+class LatentFrameStackReplayBuffer(FrameStackReplayBuffer):
+    def __init__(self, size, frame_stack, encoder, seed=None):
+        """Frame-stack replay buffer which also keeps the latent of every stored stack, computed
+        once by a frozen encoder when the stack enters the buffer. Slot i holds the latent of
+        the stack ending at slot i, so z_t and z_tp1 of a transition are read from slots i and
+        i+1. Sampled batches end with the z_t and z_tp1 batches.
+
+        Parameters
+        ----------
+        size: int
+            Number of frame slots in the buffer. When the buffer
+            overflows the old memories are dropped.
+        frame_stack: int
+            Number of frames stacked along the channel dimension of an observation.
+        encoder: callable
+            Maps a single observation to its latent as a np.array. Must be deterministic,
+            e.g. a random encoder without batch norm.
+        seed: int
+            Seed of the random generator used to sample indices.
+        """
+        super().__init__(size, frame_stack, seed)
+        self._encoder = encoder
+        self._latents = None
+        self._latent_shape = None
+        self._last_z_tp1 = None
+
+    def _allocate(self, obs_t, action, done):
+        self._empty('latents', (self._maxsize, *self._latent_shape), np.float32)
+        super()._allocate(obs_t, action, done)
+
+    def _bind_arrays(self):
+        super()._bind_arrays()
+        self._latents = self._arrays['latents']
+
+    def _set_state(self, state):
+        super()._set_state(state)
+        self._last_z_tp1 = None
+
+    def add(self, obs_t, action, obs_tp1, done, new_episode=False):
+        if new_episode or not self._episode_open:
+            z_t = self._encoder(obs_t)
+        else:
+            z_t = self._last_z_tp1
+        z_tp1 = self._encoder(obs_tp1)
+        self._latent_shape = np.shape(z_t)
+        super().add(obs_t, action, obs_tp1, done, new_episode)
+        # The slot of obs_tp1 was written last, the one of obs_t right before it
+        self._latents[(self._next_idx - 2) % self._maxsize] = z_t
+        self._latents[(self._next_idx - 1) % self._maxsize] = z_tp1
+        self._last_z_tp1 = z_tp1
+
+    def _encode_sample(self, idxes):
+        return super()._encode_sample(idxes) + (self._latents[idxes], self._latents[(idxes + 1) % self._maxsize])
+
+
+class MemmapBuffer(object):
+    HEADER_FILE = 'header.npy'
+
+    def __init__(self, size, folder_path, **kwargs):
+        """Keep the arrays of the array buffer class this is combined with (see
+        MemmapDynamicsReplayBuffer) in memory-mapped .npy files inside folder_path, so the
+        buffer can be larger than RAM. Appends are written sequentially and sampled batches
+        are gathered straight from the page cache. A small header file records the capacity,
+        write index and fill level. If folder_path already holds a buffer, its files are
+        reattached and the buffer continues where it stopped.
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store in the buffer. When the buffer
+            overflows the old memories are dropped.
+        folder_path: str
+            Folder holding the buffer's files.
+        """
+        super(MemmapBuffer, self).__init__(size, **kwargs)
+        self._folder_path = folder_path
+        self._header = None  # [capacity, next_idx, num_stored]
+        os.makedirs(folder_path, exist_ok=True)
+        if os.path.exists(self._file_path(self.HEADER_FILE)):
+            self._attach()
+
+    def _file_path(self, file_name):
+        return os.path.join(self._folder_path, file_name)
+
+    def _empty(self, name, shape, dtype):
+        self._arrays[name] = np.lib.format.open_memmap(self._file_path(name + '.npy'), mode='w+',
+                                                       dtype=dtype, shape=shape)
+        return self._arrays[name]
+
+    def _allocate(self, *args):
+        super()._allocate(*args)
+        self._header = np.lib.format.open_memmap(self._file_path(self.HEADER_FILE), mode='w+',
+                                                 dtype=np.int64, shape=(3,))
+        self._header[:] = (self._maxsize, self._next_idx, self._num_stored)
+
+    def _attach(self):
+        self._header = np.load(self._file_path(self.HEADER_FILE), mmap_mode='r+')
+        capacity, self._next_idx, self._num_stored = (int(i) for i in self._header)
+        assert capacity == self._maxsize, f'Buffer in {self._folder_path} has size {capacity}, not {self._maxsize}.'
+        for file_name in sorted(os.listdir(self._folder_path)):
+            if file_name.endswith('.npy') and file_name != self.HEADER_FILE:
+                self._arrays[file_name[:-len('.npy')]] = np.load(self._file_path(file_name), mmap_mode='r+')
+        self._bind_arrays()
+        print(f'Reattached replay buffer in {self._folder_path} ({self._num_stored}/{self._maxsize} slots filled).')
+
+    def _advance(self):
+        super()._advance()
+        self._header[1:] = (self._next_idx, self._num_stored)  # Written after the data it accounts for
+
+    def _restore_array(self, name, snapshot):
+        self._empty(name, (self._maxsize, *snapshot.shape[1:]), snapshot.dtype)[:len(snapshot)] = snapshot
+
+    def save(self, folder_path):
+        assert os.path.realpath(folder_path) != os.path.realpath(self._folder_path), \
+            'Buffer files are already on disk, use flush to persist them.'
+        super().save(folder_path)
+
+    def load(self, folder_path):
+        """Copy a snapshot written by save into the buffer's memory-mapped files."""
+        super().load(folder_path)
+        self._header = np.lib.format.open_memmap(self._file_path(self.HEADER_FILE), mode='w+',
+                                                 dtype=np.int64, shape=(3,))
+        self._header[:] = (self._maxsize, self._next_idx, self._num_stored)
+        self.flush()
+
+    def flush(self):
+        """Write all pending changes of the memory maps to disk."""
+        for array in self._arrays.values():
+            array.flush()
+        if self._header is not None:
+            self._header.flush()
+
+
+class MemmapReplayBuffer(MemmapBuffer, ArrayReplayBuffer):
+    pass
+
+
+class MemmapDynamicsReplayBuffer(MemmapBuffer, ArrayDynamicsReplayBuffer):
+    pass
+
+
+class MemmapFrameStackReplayBuffer(MemmapBuffer, FrameStackReplayBuffer):
+    pass
+
+
+class MemmapLatentFrameStackReplayBuffer(MemmapBuffer, LatentFrameStackReplayBuffer):
+    pass
+
+
+class PrioritizedBuffer(object):
+    def __init__(self, size, alpha, **kwargs):
+        """Create Prioritized Replay buffer. This class adds prioritization to the replay
+        buffer class it is combined with, see PrioritizedReplayBuffer.
 
         Parameters
         ----------
@@ -203,7 +712,7 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         --------
         ReplayBuffer.__init__
         """
-        super(PrioritizedReplayBuffer, self).__init__(size)
+        super(PrioritizedBuffer, self).__init__(size, **kwargs)
         assert alpha >= 0
         self._alpha = alpha
 
@@ -214,6 +723,8 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_sum = SumSegmentTree(it_capacity)
         self._it_min = MinSegmentTree(it_capacity)
         self._max_priority = 1.0
+        if not hasattr(self, '_rng'):  # ReplayBuffer has no seeded generator of its own
+            self._rng = np.random.RandomState()
 
     def add(self, *args, **kwargs):
         """See ReplayBuffer.store_effect"""
@@ -222,15 +733,22 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_sum[idx] = self._max_priority ** self._alpha
         self._it_min[idx] = self._max_priority ** self._alpha
 
+    def _state(self):
+        state = super()._state()
+        state.update(it_sum=self._it_sum._value[:], it_min=self._it_min._value[:], max_priority=self._max_priority)
+        return state
+
+    def _set_state(self, state):
+        super()._set_state(state)
+        self._it_sum._value[:] = state['it_sum']
+        self._it_min._value[:] = state['it_min']
+        self._max_priority = state['max_priority']
+
     def _sample_proportional(self, batch_size):
-        res = []
-        p_total = self._it_sum.sum(0, len(self._storage) - 1)
+        p_total = self._it_sum.sum(0, len(self) - 1)
         every_range_len = p_total / batch_size
-        for i in range(batch_size):
-            mass = random.random() * every_range_len + i * every_range_len
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
+        mass = (self._rng.random_sample(batch_size) + np.arange(batch_size)) * every_range_len
+        return self._it_sum.find_prefixsum_idx(mass)
 
     def sample(self, batch_size, beta):
         """Sample a batch of experiences.
@@ -268,22 +786,36 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             Array of shape (batch_size,) and dtype np.int32
             idexes in buffer of sampled experiences
         """
-        assert beta > 0
-
         idxes = self._sample_proportional(batch_size)
-
-        weights = []
-        p_min = self._it_min.min() / self._it_sum.sum()
-        max_weight = (p_min * len(self._storage)) ** (-beta)
-
-        for idx in idxes:
-            p_sample = self._it_sum[idx] / self._it_sum.sum()
-            weight = (p_sample * len(self._storage)) ** (-beta)
-            weights.append(weight / max_weight)
-        weights = np.array(weights)
+        weights = self.importance_weights(idxes, beta)
         encoded_sample = self._encode_sample(idxes)
         return tuple(list(encoded_sample) + [weights, idxes])
 
+    def importance_weights(self, idxes, beta):
+        """Compute the importance sampling weights of a batch of
+        transitions, normalized by the largest possible weight.
+
+        Parameters
+        ----------
+        idxes: np.array
+            idxes in buffer of sampled experiences
+        beta: float
+            To what degree to use importance weights
+            (0 - no corrections, 1 - full correction)
+
+        Returns
+        -------
+        weights: np.array
+            Array of shape (batch_size,) and dtype np.float32
+        """
+        assert beta > 0
+        p_total = self._it_sum.sum()
+        p_min = self._it_min.min() / p_total
+        max_weight = (p_min * len(self)) ** (-beta)
+        p_samples = self._it_sum[idxes] / p_total
+        weights = (p_samples * len(self)) ** (-beta) / max_weight
+        return weights.astype(np.float32)
+
     def update_priorities(self, idxes, priorities):
         """Update priorities of sampled transitions.
 
@@ -292,18 +824,32 @@ class PrioritizedReplayBuffer(ReplayBuffer):
 
         Parameters
         ----------
-        idxes: [int]
+        idxes: [int] or np.array
             List of idxes of sampled transitions
-        priorities: [float]
+        priorities: [float], np.array or torch.Tensor
             List of updated priorities corresponding to
             transitions at the sampled idxes denoted by
             variable `idxes`.
         """
+        if hasattr(priorities, 'detach'):  # torch.Tensor
+            priorities = priorities.detach().cpu().numpy()
+        idxes = np.asarray(idxes, dtype=np.int64).reshape((-1,))
+        priorities = np.asarray(priorities, dtype=np.float64).reshape((-1,))
         assert len(idxes) == len(priorities)
-        for idx, priority in zip(idxes, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
+        assert np.all(0 <= idxes) and np.all(idxes < len(self))
+        assert np.all(np.isfinite(priorities)) and np.all(priorities > 0)
+        self._it_sum[idxes] = priorities ** self._alpha
+        self._it_min[idxes] = priorities ** self._alpha
+        self._max_priority = max(self._max_priority, priorities.max())
+
+
+class PrioritizedReplayBuffer(PrioritizedBuffer, ReplayBuffer):
+    pass
+
+
+class PrioritizedArrayReplayBuffer(PrioritizedBuffer, ArrayReplayBuffer):
+    pass
+
 
-            self._max_priority = max(self._max_priority, priority)
+class PrioritizedArrayDynamicsReplayBuffer(PrioritizedBuffer, ArrayDynamicsReplayBuffer):
+    pass
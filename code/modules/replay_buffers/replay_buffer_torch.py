@@ -1,5 +1,8 @@
+import numpy as np
 import torch
 import random
+import pickle
+import os
 
 
 class ReplayBuffer(object):
@@ -183,3 +186,197 @@ class DynamicsReplayBuffer(object):
 
     def return_all(self):
         return self._encode_sample(torch.arange(len(self._storage)))
+
+
+class TensorBuffer(object):
+    STATE_FILE = 'state.pkl'
+
+    def __init__(self, size, device='cpu', dtype=None, seed=None):
+        """Create a ring buffer which stores every field of a transition in its own
+        preallocated tensor on the given device. Tensors are allocated on the first call to
+        add, using the shapes and dtypes of the first transition. Transitions are written by
+        slice assignment and batches are gathered with a single index_select per field, so
+        sampled batches never leave the device.
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store in the buffer. When the buffer
+            overflows the old memories are dropped.
+        device: str or torch.device
+            Device holding the buffer, e.g. the device of the model.
+        dtype: torch.dtype
+            If given, floating point fields are stored in this dtype. Integer fields such as
+            uint8 frames and actions keep their dtype.
+        seed: int
+            Seed of the random generator used to sample indices.
+        """
+        self._storage = None  # Tuple of per-field tensors of shape (size, *field_shape)
+        self._maxsize = int(size)
+        self._next_idx = 0
+        self._num_stored = 0
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self._generator = torch.Generator(device=self.device)
+        if seed is not None:
+            self._generator.manual_seed(seed)
+        else:
+            self._generator.seed()
+
+    def __len__(self):
+        return self._num_stored
+
+    def _to_tensor(self, d):
+        d = torch.as_tensor(d, device=self.device)
+        if self.dtype is not None and d.is_floating_point():
+            d = d.to(dtype=self.dtype)
+        return d
+
+    def _field_dtypes(self, data):
+        return [d.dtype for d in data]
+
+    def _allocate(self, data):
+        self._storage = tuple(torch.zeros((self._maxsize, *d.shape), dtype=dtype, device=self.device)
+                              for d, dtype in zip(data, self._field_dtypes(data)))
+
+    def _add_data(self, data):
+        data = [self._to_tensor(d) for d in data]
+        if self._storage is None:
+            self._allocate(data)
+        for field, d in zip(self._storage, data):
+            field[self._next_idx] = d
+        self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._num_stored = min(self._num_stored + 1, self._maxsize)
+
+    def add_batch(self, *data):
+        """Add a batch of transitions, given as one tensor or array per field with the batch
+        along the first dimension. Each field is written with at most two slice assignments.
+        """
+        data = [self._to_tensor(d) for d in data]
+        if self._storage is None:
+            self._allocate([d[0] for d in data])
+        n = len(data[0])
+        assert n <= self._maxsize, 'Batch is larger than the buffer.'
+        first = min(n, self._maxsize - self._next_idx)
+        for field, d in zip(self._storage, data):
+            field[self._next_idx:self._next_idx + first] = d[:first]
+            field[:n - first] = d[first:]  # Part of the batch which wraps around
+        self._next_idx = (self._next_idx + n) % self._maxsize
+        self._num_stored = min(self._num_stored + n, self._maxsize)
+
+    def _sample_idxes(self, batch_size):
+        return torch.randint(0, self._num_stored, (batch_size,), generator=self._generator, device=self.device)
+
+    def _encode_sample(self, idxes):
+        return tuple(field.index_select(0, idxes) for field in self._storage)
+
+    def sample(self, batch_size):
+        """Sample a batch of experiences. Each field is gathered with a single index_select and
+        returned as a tensor on the buffer's device. See ReplayBuffer.sample and
+        DynamicsReplayBuffer.sample for the returned fields.
+
+        Parameters
+        ----------
+        batch_size: int
+            How many transitions to sample.
+        """
+        return self._encode_sample(self._sample_idxes(batch_size))
+
+    def sample_states(self, batch_size):
+        """Sample a batch of experiences.
+
+        Parameters
+        ----------
+        batch_size: int
+            How many transitions to sample.
+
+        Returns
+        -------
+        obs_batch: torch.Tensor
+            batch of observations
+        """
+        return self._storage[0].index_select(0, self._sample_idxes(batch_size))
+
+    def return_all(self):
+        return tuple(field[:self._num_stored] for field in self._storage)
+
+    def save(self, folder_path):
+        """Write a snapshot of the buffer to folder_path, in the format of ArrayBuffer.save: one
+        .npy file per field, holding only the filled slots, and a small state file with the write
+        index, fill level and the state of the sampling random generator. Files are replaced
+        atomically, so a snapshot can be saved over the one the buffer was loaded from.
+
+        Parameters
+        ----------
+        folder_path: str
+            Folder to write the snapshot to.
+        """
+        os.makedirs(folder_path, exist_ok=True)
+        names = []
+        for i, field in enumerate(self._storage or ()):
+            names.append(f'field{i}')
+            file_path = os.path.join(folder_path, names[-1] + '.npy')
+            with open(file_path + '.tmp', 'wb') as f:
+                np.save(f, field[:self._num_stored].cpu().numpy())
+            os.replace(file_path + '.tmp', file_path)
+        state = {'size': self._maxsize, 'next_idx': self._next_idx, 'num_stored': self._num_stored,
+                 'arrays': names, 'generator_state': self._generator.get_state()}
+        with open(os.path.join(folder_path, self.STATE_FILE + '.tmp'), 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(os.path.join(folder_path, self.STATE_FILE + '.tmp'), os.path.join(folder_path, self.STATE_FILE))
+
+    def load(self, folder_path):
+        """Restore a snapshot written by save. On the CPU, the fields of a full buffer wrap a
+        copy-on-write memory map of the snapshot instead of being read, so loading is almost
+        instant and the snapshot files are never modified.
+
+        Parameters
+        ----------
+        folder_path: str
+            Folder holding the snapshot.
+        """
+        with open(os.path.join(folder_path, self.STATE_FILE), 'rb') as f:
+            state = pickle.load(f)
+        assert state['size'] == self._maxsize, f'Snapshot has size {state["size"]}, not {self._maxsize}.'
+        storage = []
+        for name in state['arrays']:
+            if not name.startswith('field'):
+                continue  # E.g. intrinsic rewards stored by the array buffers
+            snapshot = torch.from_numpy(np.load(os.path.join(folder_path, name + '.npy'), mmap_mode='c'))
+            if len(snapshot) == self._maxsize and self.device.type == 'cpu':
+                storage.append(snapshot)
+            else:
+                field = torch.zeros((self._maxsize, *snapshot.shape[1:]), dtype=snapshot.dtype, device=self.device)
+                field[:len(snapshot)] = snapshot
+                storage.append(field)
+        self._storage = tuple(storage) if storage else None
+        self._next_idx, self._num_stored = state['next_idx'], state['num_stored']
+        if 'generator_state' in state:
+            self._generator.set_state(state['generator_state'])
+        print(f'Loaded replay buffer from {folder_path} ({self._num_stored}/{self._maxsize} slots filled).')
+
+
+class TensorReplayBuffer(TensorBuffer):
+    REWARD_FIELD = 2
+
+    def add(self, obs_t, action, reward, obs_tp1, done):
+        self._add_data((obs_t, action, reward, obs_tp1, done))
+
+    def _field_dtypes(self, data):
+        dtypes = super()._field_dtypes(data)
+        dtypes[self.REWARD_FIELD] = self.dtype or torch.float32  # First reward could be an int, later ones won't
+        return dtypes
+
+    def update_rewards(self, rewards, idxes):
+        """"
+        Replaces reward value in given transition indices with a single vectorized write.
+        """
+        idxes = torch.as_tensor(idxes, dtype=torch.long, device=self.device)
+        self._storage[self.REWARD_FIELD][idxes] = torch.as_tensor(
+            rewards, dtype=self._storage[self.REWARD_FIELD].dtype, device=self.device).reshape(idxes.shape)
+
+
+class TensorDynamicsReplayBuffer(TensorBuffer):
+
+    def add(self, obs_t, action, obs_tp1, done):
+        self._add_data((obs_t, action, obs_tp1, done))
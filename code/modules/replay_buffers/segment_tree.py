@@ -1,5 +1,5 @@
 # This file is used by the OpenAI replay buffers in replay_buffer.py
-import operator
+import numpy as np
 
 
 class SegmentTree(object):
@@ -17,12 +17,15 @@ class SegmentTree(object):
                `reduce` operation which reduces `operation` over
                a contiguous subsequence of items in the array.
 
+        Nodes are kept in a single NumPy array, so items can be set and read
+        for a whole batch of indices at once.
+
         Paramters
         ---------
         capacity: int
             Total size of the array - must be a power of two.
-        operation: lambda obj, obj -> obj
-            and operation for combining elements (eg. sum, max)
+        operation: np.ufunc
+            element-wise operation for combining elements (eg. np.add, np.maximum)
             must form a mathematical group together with the set of
             possible values for array elements (i.e. be associative)
         neutral_element: obj
@@ -31,7 +34,7 @@ class SegmentTree(object):
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._value = np.full((2 * capacity,), neutral_element, dtype=np.float64)
         self._operation = operation
 
     def _reduce_helper(self, start, end, node, node_start, node_end):
@@ -75,19 +78,24 @@ class SegmentTree(object):
         return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
 
     def __setitem__(self, idx, val):
+        """Set one leaf or a batch of leaves. Parents are refreshed one tree level
+        at a time, only for the nodes above the changed leaves."""
         # index of the leaf
-        idx += self._capacity
+        idx = np.asarray(idx, dtype=np.int64) + self._capacity
+        if idx.size == 0:
+            return
         self._value[idx] = val
-        idx //= 2
-        while idx >= 1:
+        idx = np.unique(idx // 2)
+        while idx[0] >= 1:  # All nodes are at the same depth
             self._value[idx] = self._operation(
                 self._value[2 * idx],
                 self._value[2 * idx + 1]
             )
-            idx //= 2
+            idx = np.unique(idx // 2)
 
     def __getitem__(self, idx):
-        assert 0 <= idx < self._capacity
+        idx = np.asarray(idx, dtype=np.int64)
+        assert np.all(0 <= idx) and np.all(idx < self._capacity)
         return self._value[self._capacity + idx]
 
 
@@ -95,7 +103,7 @@ class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
-            operation=operator.add,
+            operation=np.add,
             neutral_element=0.0
         )
 
@@ -109,34 +117,39 @@ class SumSegmentTree(SegmentTree):
 
         if array values are probabilities, this function
         allows to sample indexes according to the discrete
-        probability efficiently.
+        probability efficiently. A batch of prefix sums is
+        searched together, descending the tree one level at a time.
 
         Parameters
         ----------
-        perfixsum: float
+        perfixsum: float or np.array
             upperbound on the sum of array prefix
 
         Returns
         -------
-        idx: int
+        idx: int or np.array
             highest index satisfying the prefixsum constraint
         """
-        assert 0 <= prefixsum <= self.sum() + 1e-5
-        idx = 1
-        while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
-                idx = 2 * idx
-            else:
-                prefixsum -= self._value[2 * idx]
-                idx = 2 * idx + 1
-        return idx - self._capacity
+        is_scalar = np.ndim(prefixsum) == 0
+        prefixsum = np.array(prefixsum, dtype=np.float64, ndmin=1)
+        if prefixsum.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        assert np.all(0 <= prefixsum) and np.all(prefixsum <= self.sum() + 1e-5)
+        idx = np.ones(prefixsum.shape, dtype=np.int64)
+        while idx[0] < self._capacity:  # while non-leaf
+            left = 2 * idx
+            go_right = self._value[left] <= prefixsum
+            prefixsum -= self._value[left] * go_right
+            idx = left + go_right
+        idx -= self._capacity
+        return int(idx[0]) if is_scalar else idx
 
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
-            operation=min,
+            operation=np.minimum,
             neutral_element=float('inf')
         )
 
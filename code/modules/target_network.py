@@ -0,0 +1,21 @@
+import torch
+
+
+def soft_update(target, source, tau):
+    # type: (torch.nn.Module, torch.nn.Module, float) -> None
+    """"
+    Polyak update of the target parameters, target = (1 - tau) * target + tau * source,
+    done for all parameters at once with a fused multi-tensor lerp.
+    """
+    with torch.no_grad():
+        torch._foreach_lerp_(list(target.parameters()), list(source.parameters()), tau)
+
+
+def hard_update(target, source):
+    # type: (torch.nn.Module, torch.nn.Module) -> None
+    """"
+    Copy the parameters and buffers of source into the already allocated ones of target.
+    """
+    with torch.no_grad():
+        torch._foreach_copy_(list(target.parameters()) + list(target.buffers()),
+                             list(source.parameters()) + list(source.buffers()))
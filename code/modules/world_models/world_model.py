@@ -6,6 +6,8 @@ from modules.encoders.learned_encoders import Encoder_1D, Encoder_2D
 from modules.encoders.random_encoder import RandomEncoder_1D, RandomEncoder_2D
 from modules.encoders.vae import VAE
 from modules.decoders.decoder import Decoder_2D, Decoder_2D_conv
+from modules.target_network import soft_update, hard_update
+from modules.loss_logging import LossAccumulator, make_losses, losses_state_dict, load_losses
 import copy
 import os
 
@@ -25,6 +27,7 @@ class VAEFM(nn.Module):
         self.target_encoder = None
         if self.soft_target or self.target_encoder_steps != 0:
             self.target_encoder = copy.deepcopy(self.vae.encoder).to(device)
+        self.tau = kwargs['wm_tau']
         self.forward_model = ForwardModel(x_dim=kwargs['z_dim'],
                                           a_dim=self.a_dim,
                                           hidden_dim=kwargs['wm_h_dim'],
@@ -37,16 +40,12 @@ class VAEFM(nn.Module):
         """
         Forward pass of the world model. Returns processed intrinsic reward and keyworded
         loss components alongside the loss. Keyworded loss components are meant for bookkeeping
-        and should be given as floats.
+        and are given as detached 0-d tensors, so that no host-device sync is needed to train.
         """
         # Section necessary for training and eval (Calculate batch-wise translation error in latent space)
-        if self.target_encoder is not None:
-            with torch.no_grad():
-                z_t, *_ = self.target_encoder(x_t)
-                z_tp1, *_ = self.target_encoder(x_tp1)
-        else:
-            z_t = self.vae.encode(x_t)
-            z_tp1 = self.vae.encode(x_tp1)
+        with torch.no_grad():
+            encoder = self.target_encoder if self.target_encoder is not None else self.vae.encoder
+            (z_t, _), (z_tp1, _) = encoder.forward_pair(x_t, x_tp1)
         z_diff = self.forward_model(z_t, a_t)
         assert not z_t.requires_grad
         assert not z_tp1.requires_grad
@@ -59,20 +58,19 @@ class VAEFM(nn.Module):
             self.train_steps += 1
             self.update_target_encoder()
             loss = vae_loss + loss_wm
-            loss_dict = {'wm_loss': loss.detach().mean().item(),
-                         'wm_trans_loss': loss_wm.detach().item(),
-                         'wm_vae_loss': vae_loss.detach().item()}
+            loss_dict = {'wm_loss': loss.detach().mean(),
+                         'wm_trans_loss': loss_wm.detach(),
+                         'wm_vae_loss': vae_loss.detach()}
         return loss_wm_vector.detach(), loss, loss_dict
 
     def update_target_encoder(self):
         if self.target_encoder is not None:
             if self.soft_target:
-                for target_param, param in zip(self.target_encoder.parameters(), self.vae.encoder.parameters()):
-                    target_param.data.copy_(target_param.data * (1.0 - 0.01) + param.data * 0.01)
+                soft_update(self.target_encoder, self.vae.encoder, self.tau)
             else:
                 assert self.target_encoder_steps != 0
                 if self.train_steps % self.target_encoder_steps == 0:
-                    self.target_encoder = copy.deepcopy(self.vae.encoder).to(self.device)
+                    hard_update(self.target_encoder, self.vae.encoder)
         else:
             assert not self.soft_target or self.target_encoder_steps == 0
 
@@ -119,12 +117,14 @@ class DeterministicCRandomEncodedFM(nn.Module):
         """
         Forward pass of the world model. Returns processed intrinsic reward and keyworded
         loss components alongside the loss. Keyworded loss components are meant for bookkeeping
-        and should be given as floats.
+        and are given as detached 0-d tensors, so that no host-device sync is needed to train.
         """
         # Section necessary for training and eval (Calculate batch-wise translation error in latent space)
-        with torch.no_grad():
-            z_t = self.encoder(x_t)
-            z_tp1 = self.encoder(x_tp1)
+        if 'z_t' in kwargs:  # Latents cached by the replay buffer, the encoder is frozen
+            z_t, z_tp1 = kwargs['z_t'].to(self.device), kwargs['z_tp1'].to(self.device)
+        else:
+            with torch.no_grad():
+                z_t, z_tp1 = self.encoder.forward_pair(x_t, x_tp1)
         z_diff = self.forward_model(z_t, a_t)
         assert not z_t.requires_grad
         assert not z_tp1.requires_grad
@@ -135,7 +135,7 @@ class DeterministicCRandomEncodedFM(nn.Module):
             loss = loss_vector.mean()
             # loss = self.loss_func_distance(z_diff, z_tp1.detach()).mean(dim=1)
             self.trains_steps += 1
-            loss_dict = {'wm_loss': loss.detach().item()}
+            loss_dict = {'wm_loss': loss.detach()}
         return loss_vector.detach(), loss, loss_dict
 
     def create_encoder(self, input_dim, **kwargs):
@@ -194,15 +194,18 @@ class DeterministicContrastiveEncodedFM(nn.Module):
             # type: (torch.tensor, torch.tensor) -> torch.tensor
             """
             Return the hinge loss between the output vector and its negative sample encodings.
-            Expected dimensions of output is (batch, zdim) which gets repeated into(batch, negsamples, zdim).
-            Negative sample encodings have expected shape (batch*negsamples, zdim).
+            Expected dimensions of output is (batch, zdim). Negative sample encodings are either shared by the whole
+            batch with shape (negsamples, zdim), or given per example with shape (batch, negsamples, zdim).
+            Energies are pairwise squared distances, computed without repeating output or the negatives.
             Implementation from https://github.com/tkipf/c-swm/blob/master/modules.py.
             """
-            assert output.shape[0] == neg_samples.shape[0] and output.shape[1] == neg_samples.shape[2], \
-                f'Received: {tuple(output.shape)} {neg_samples.shape}'
-            output = output.unsqueeze(1).repeat((1, neg_samples.shape[1], 1))
-            diff = output - neg_samples
-            energy = diff.pow(2).sum(dim=2)
+            assert output.shape[-1] == neg_samples.shape[-1], f'Received: {tuple(output.shape)} {neg_samples.shape}'
+            if len(tuple(neg_samples.shape)) == 2:
+                energy = torch.cdist(output, neg_samples, compute_mode='donot_use_mm_for_euclid_dist').pow(2)
+            else:
+                assert output.shape[0] == neg_samples.shape[0], f'Received: {tuple(output.shape)} {neg_samples.shape}'
+                energy = torch.cdist(output.unsqueeze(1), neg_samples,
+                                     compute_mode='donot_use_mm_for_euclid_dist').pow(2).squeeze(1)
             # energy = energy.mean(dim=1)
             hinge_loss = -energy + self.hinge
             hinge_loss = hinge_loss.clamp(min=0.0)
@@ -225,6 +228,7 @@ class DeterministicContrastiveEncodedFM(nn.Module):
             self.target_encoder = copy.deepcopy(self.encoder).to(device)
         self.tau = kwargs['wm_tau']
         self.neg_samples = kwargs['neg_samples']
+        self.in_batch_negatives = kwargs.get('gridworld_ns_pool') == 'batch'
         self.forward_model = ForwardModel(x_dim=self.encoder.get_z_dim(),
                                           a_dim=self.a_dim,
                                           hidden_dim=kwargs['wm_h_dim'],
@@ -240,21 +244,19 @@ class DeterministicContrastiveEncodedFM(nn.Module):
         if len(tuple(x_tp1.shape)) == 1:  # Add batch dimension to 1D tensor
             x_tp1 = x_tp1.unsqueeze(0)
         # Section necessary for training and eval (Calculate batch-wise translation error in latent space)
-        z_t = self.encoder(x_t)
+        z_t, z_tp1 = self.encode_pair(x_t, x_tp1)
         z_diff = self.forward_model(z_t, a_t)
-        if self.target_encoder is not None:
-            with torch.no_grad():
-                z_tp1 = self.target_encoder(x_tp1)
-        else:
-            z_tp1 = self.encoder(x_tp1)
         loss_trans = self.loss_func_distance(z_t + z_diff, z_tp1).sum(dim=1)
         # Section necessary only for training (Calculate negative sampling error and overall loss)
         loss_ns, loss, loss_dict = None, None, None
         if not eval:
-            if self.neg_samples > 0:
+            if self.in_batch_negatives:
+                loss_ns = self.calculate_in_batch_contrastive_loss(z_t, z_tp1)
+                loss = (loss_trans + loss_ns).mean()
+            elif self.neg_samples > 0:
                 if not isinstance(kwargs['memories'], torch.Tensor):
-                    neg_samples = torch.from_numpy(kwargs['memories'].sample_states(self.neg_samples)).to(
-                        dtype=torch.float32, device=self.device)
+                    from utils.utils import state_to_torch  # Lazy, utils pulls in torchvision and cv2
+                    neg_samples = state_to_torch(kwargs['memories'].sample_states(self.neg_samples), self.device)
                 else:
                     neg_samples = kwargs['memories']
                 loss_ns = self.calculate_contrastive_loss(neg_samples, z_t=z_t, pos_examples_z=z_tp1)
@@ -263,9 +265,9 @@ class DeterministicContrastiveEncodedFM(nn.Module):
                 loss = loss_trans.mean()
             self.train_steps += 1
             self.update_target_encoder()
-            loss_dict = {'wm_loss': loss.detach().item(),
-                         'wm_trans_loss': loss_trans.detach().mean().item(),
-                         'wm_ns_loss': loss_ns.detach().mean().item()}
+            loss_dict = {'wm_loss': loss.detach(),
+                         'wm_trans_loss': loss_trans.detach().mean(),
+                         'wm_ns_loss': loss_ns.detach().mean()}
         return loss_trans.detach(), loss, loss_dict
 
     def calculate_contrastive_loss(self, neg_examples, x_t=None, z_t=None, pos_examples=None, pos_examples_z=None):
@@ -284,8 +286,6 @@ class DeterministicContrastiveEncodedFM(nn.Module):
             neg_examples = neg_examples.unsqueeze(0)
 
         neg_samples_z = self.encoder(neg_examples)
-        neg_samples_z = neg_samples_z.unsqueeze(0)
-        neg_samples_z = neg_samples_z.repeat((z_t.shape[0], 1, 1))
         loss = self.loss_func_neg_sampling(z_t, neg_samples_z)
         # Positive examples below
         if pos_examples is not None:
@@ -304,27 +304,46 @@ class DeterministicContrastiveEncodedFM(nn.Module):
                     assert pos_examples_z.shape[0] % z_t.shape[0] == 0, \
                         "There should be an equal amount of pos examples per z."
                     pos_examples_z = pos_examples_z.view((z_t.shape[0], pos_examples_z.shape[0] // z_t.shape[0], -1))
-            z_t_expanded = z_t.unsqueeze(1).repeat((1, pos_examples_z.shape[1], 1))
-            pos_loss = (z_t_expanded - pos_examples_z).pow(2).sum(dim=2) - self.loss_func_neg_sampling.hinge
+            pos_loss = (z_t.unsqueeze(1) - pos_examples_z).pow(2).sum(dim=2) - self.loss_func_neg_sampling.hinge
             pos_loss = pos_loss.clamp(min=0.0).mean(dim=1)
             loss += pos_loss
         return loss.mean()
 
-    def forward_fm_only(self, x_t, a_t, x_tp1, eval=False):
-        # type: (torch.Tensor, torch.Tensor, torch.Tensor, bool) -> [torch.Tensor, list, dict]
+    def calculate_in_batch_contrastive_loss(self, z_t, z_tp1):
+        # type: (torch.Tensor, torch.Tensor) -> torch.Tensor
+        """
+        Contrastive loss where the negatives of every z_t are the z_t and z_tp1 of the other batch elements.
+        Its own z_t and z_tp1 are masked out of the negatives, z_tp1 is used as its positive example.
+        """
+        if len(tuple(z_t.shape)) == 1:  # Add batch dimension to 1D tensor
+            z_t = z_t.unsqueeze(0)
+        if len(tuple(z_tp1.shape)) == 1:  # Add batch dimension to 1D tensor
+            z_tp1 = z_tp1.unsqueeze(0)
+        batch_size = z_t.shape[0]
+        assert batch_size > 1, 'In-batch negatives need a batch of more than one transition.'
+        hinge = self.loss_func_neg_sampling.hinge
+        candidates = torch.cat((z_t, z_tp1), dim=0)
+        energy = torch.cdist(z_t, candidates, compute_mode='donot_use_mm_for_euclid_dist').pow(2)
+        not_self = ~torch.eye(batch_size, dtype=torch.bool, device=z_t.device).repeat(1, 2)
+        neg_loss = (hinge - energy).clamp(min=0.0) * not_self
+        neg_loss = neg_loss.sum(dim=1) / (2 * (batch_size - 1))
+        pos_loss = ((z_t - z_tp1).pow(2).sum(dim=1) - hinge).clamp(min=0.0)
+        return (neg_loss + pos_loss).mean()
+
+    def forward_fm_only(self, x_t, a_t, x_tp1, eval=False, z_t=None, z_tp1=None):
+        # type: (torch.Tensor, torch.Tensor, torch.Tensor, bool, torch.Tensor, torch.Tensor) -> [torch.Tensor, list, dict]
         """"
         Forward pass where gradients are only applied to the forward model.
+        Already computed encodings can be passed as z_t and z_tp1 to skip the encoder pass.
         """
-        if len(tuple(x_t.shape)) == 1:  # Add batch dimension to 1D tensor
-            x_t = x_t.unsqueeze(0)
-        if len(tuple(x_tp1.shape)) == 1:  # Add batch dimension to 1D tensor
-            x_tp1 = x_tp1.unsqueeze(0)
-        with torch.no_grad():
-            z_t = self.encoder(x_t)
-            if self.target_encoder is not None:
-                z_tp1 = self.target_encoder(x_tp1)
-            else:
-                z_tp1 = self.encoder(x_tp1)
+        if z_t is None or z_tp1 is None:
+            if len(tuple(x_t.shape)) == 1:  # Add batch dimension to 1D tensor
+                x_t = x_t.unsqueeze(0)
+            if len(tuple(x_tp1.shape)) == 1:  # Add batch dimension to 1D tensor
+                x_tp1 = x_tp1.unsqueeze(0)
+            with torch.no_grad():
+                z_t, z_tp1 = self.encode_pair(x_t, x_tp1)
+        z_t, z_tp1 = z_t.detach(), z_tp1.detach()
         z_diff = self.forward_model(z_t, a_t)
         loss_vector = self.loss_func_distance(z_t + z_diff, z_tp1).sum(dim=1)
         loss = loss_vector.mean()
@@ -332,19 +351,18 @@ class DeterministicContrastiveEncodedFM(nn.Module):
         if not eval:
             self.train_steps += 1
             self.update_target_encoder()
-            loss_dict = {'wm_loss': loss.detach().item(),
-                         'wm_trans_loss': loss.detach().mean().item()}
+            loss_dict = {'wm_loss': loss.detach(),
+                         'wm_trans_loss': loss.detach().mean()}
         return loss_vector.detach(), loss, loss_dict
 
     def update_target_encoder(self):
         if self.target_encoder is not None:
             if self.soft_target:
-                for target_param, param in zip(self.target_encoder.parameters(), self.encoder.parameters()):
-                    target_param.data.copy_(target_param.data * (1.0 - 0.01) + param.data * 0.01)
+                soft_update(self.target_encoder, self.encoder, self.tau)
             else:
                 assert self.target_encoder_steps != 0
                 if self.train_steps % self.target_encoder_steps == 0:
-                    self.target_encoder = copy.deepcopy(self.encoder)
+                    hard_update(self.target_encoder, self.encoder)
         else:
             assert not self.soft_target or self.target_encoder_steps == 0
 
@@ -363,6 +381,18 @@ class DeterministicContrastiveEncodedFM(nn.Module):
     def encode(self, x):
         return self.encoder(x)
 
+    def encode_pair(self, x_t, x_tp1):
+        # type: (torch.Tensor, torch.Tensor) -> [torch.Tensor, torch.Tensor]
+        """"
+        Encode x_t with the encoder and x_tp1 with the target encoder if there is one, otherwise both in one pass.
+        """
+        if self.target_encoder is not None:
+            z_t = self.encoder(x_t)
+            with torch.no_grad():
+                z_tp1 = self.target_encoder(x_tp1)
+            return z_t, z_tp1
+        return self.encoder.forward_pair(x_t, x_tp1)
+
     def target_encode(self, x):
         with torch.no_grad():
             return self.target_encoder(x)
@@ -448,12 +478,11 @@ class DeterministicInvDynFeatFM(nn.Module):
     def forward(self, x_t, a_t, x_tp1, eval=False, **kwargs):
         # type: (torch.Tensor, torch.Tensor, torch.Tensor, bool, dict) -> [torch.Tensor, torch.Tensor, dict]
         # Section necessary for training and eval (Calculate batch-wise translation error in latent space)
-        phi_t = self.encoder(x_t)
-        phi_tp1 = self.encoder(x_tp1)
         if self.target_encoder is not None:
             with torch.no_grad():
-                phi_t = self.target_encoder(x_t)
-                phi_tp1 = self.target_encoder(x_tp1)
+                phi_t, phi_tp1 = self.target_encoder.forward_pair(x_t, x_tp1)
+        else:
+            phi_t, phi_tp1 = self.encoder.forward_pair(x_t, x_tp1)
         phi_diff = self.forward_model(phi_t, a_t)
         loss_trans = self.loss_func_distance(phi_t + phi_diff, phi_tp1).sum(dim=1)
         loss, loss_dict = None, None
@@ -465,9 +494,9 @@ class DeterministicInvDynFeatFM(nn.Module):
             self.train_steps += 1
             self.update_target_encoder()
             loss = loss_trans_mean + inverse_loss
-            loss_dict = {'wm_loss': loss.detach().item(),
-                         'wm_trans_loss': loss_trans_mean.detach().item(),
-                         'wm_inv_loss': inverse_loss.detach().item()}
+            loss_dict = {'wm_loss': loss.detach(),
+                         'wm_trans_loss': loss_trans_mean.detach(),
+                         'wm_inv_loss': inverse_loss.detach()}
         return loss_trans.detach(), loss, loss_dict
 
     def action_index_to_onehot(self, a_i):
@@ -492,12 +521,11 @@ class DeterministicInvDynFeatFM(nn.Module):
     def update_target_encoder(self):
         if self.target_encoder is not None:
             if self.soft_target:
-                for target_param, param in zip(self.target_encoder.parameters(), self.encoder.parameters()):
-                    target_param.data.copy_(target_param.data * (1.0 - 0.01) + param.data * 0.01)
+                soft_update(self.target_encoder, self.encoder, self.tau)
             else:
                 assert self.target_encoder_steps != 0
                 if self.train_steps % self.target_encoder_steps == 0:
-                    self.target_encoder = copy.deepcopy(self.encoder)
+                    hard_update(self.target_encoder, self.encoder)
         else:
             assert not self.soft_target or self.target_encoder_steps == 0
 
@@ -578,15 +606,26 @@ class EncodedWorldModel:
                 self.optimizer_d = torch.optim.Adam(self.decoder.parameters())
             elif self.enc_is_vae:
                 self.decoder = self.model.vae.decoder
-        self.losses = {'wm_loss': [], 'wm_trans_loss': [], 'wm_ns_loss': [],
-                       'wm_inv_loss': [], 'wm_vae_loss': [], 'decoder_loss': []}
+        self._loss_flush_interval = kwargs['export_interval']
+        self.losses = make_losses(('wm_loss', 'wm_trans_loss', 'wm_ns_loss',
+                                   'wm_inv_loss', 'wm_vae_loss', 'decoder_loss'))
         self._its_a_gridworld_bois = kwargs['env_name'][:9] == 'GridWorld'
         self.state_wise_loss = {} if self._its_a_gridworld_bois else None
         self.state_wise_loss_diff = {} if self._its_a_gridworld_bois else None
 
+    @property
+    def losses(self):
+        # type: () -> dict
+        return self.loss_log.flush()
+
+    @losses.setter
+    def losses(self, losses):
+        # type: (dict) -> None
+        self.loss_log = LossAccumulator(losses, flush_interval=self._loss_flush_interval)
+
     def forward(self, x_t, a_t, x_tp1, **kwargs):
         # type: (torch.Tensor, torch.Tensor, torch.Tensor, dict) -> torch.Tensor
-        assert tuple(x_t.shape[-3:]) == self.x_dim, f'Received: {tuple(x_t.shape[1:])} {self.x_dim}'
+        assert tuple(x_t.shape[-len(self.x_dim):]) == self.x_dim, f'Received: {tuple(x_t.shape[1:])} {self.x_dim}'
         with torch.no_grad():
             intr_reward, *_ = self.model.forward(x_t, a_t, x_tp1, eval=True, **kwargs)
         return intr_reward
@@ -602,8 +641,7 @@ class EncodedWorldModel:
         loss.backward()
         torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
         self.optimizer_wm.step()
-        for key in loss_items:
-            self.losses[key].append(loss_items[key])
+        self.loss_log.update(loss_items)
         if self._its_a_gridworld_bois and store_loss and 'distance' in kwargs:
             key = str(x_t.cpu().numpy().tolist()) + str(a_t.cpu().numpy().tolist())
             if key in self.state_wise_loss_diff:
@@ -628,7 +666,7 @@ class EncodedWorldModel:
         loss_d.backward()
         torch.nn.utils.clip_grad_norm_(self.decoder.parameters(), 1.0)
         self.optimizer_d.step()
-        self.losses['decoder_loss'].append(loss_d.item())
+        self.loss_log.append('decoder_loss', loss_d.detach())
 
     def encode(self, x):
         with torch.no_grad():
@@ -657,7 +695,7 @@ class EncodedWorldModel:
         os.makedirs(folder_path, exist_ok=True)
         torch.save({'model': self.model,
                     'optimizer_wm': self.optimizer_wm,
-                    'losses': self.losses,
+                    'losses': losses_state_dict(self.losses),
                     'decoder': self.decoder,
                     'optimizer_d': self.optimizer_d,
                     'state_wise_loss': self.state_wise_loss,
@@ -677,7 +715,7 @@ class EncodedWorldModel:
         self.optimizer_wm = checkpoint['optimizer_wm']
         self.decoder = checkpoint['decoder']
         self.optimizer_d = checkpoint['optimizer_d']
-        self.losses = checkpoint['losses']
+        self.losses = load_losses(checkpoint['losses'])
         self.state_wise_loss = checkpoint['state_wise_loss']
         self.state_wise_loss_diff = checkpoint['state_wise_loss_diff']
 
@@ -702,14 +740,25 @@ class WorldModelContrastive:
             self.optimizer_enc = torch.optim.Adam(self.model.encoder.parameters(), lr=kwargs['wm_enc_lr'])
         else:
             raise NameError('What optimizer??')
-        self.losses = {'wm_loss': [], 'wm_trans_loss': [], 'wm_ns_loss': []}
+        self._loss_flush_interval = kwargs['export_interval']
+        self.losses = make_losses(('wm_loss', 'wm_trans_loss', 'wm_ns_loss'))
         self._its_a_gridworld_bois = kwargs['env_name'][:9] == 'GridWorld'
         self.state_wise_loss = {} if self._its_a_gridworld_bois else None
         self.state_wise_loss_diff = {} if self._its_a_gridworld_bois else None
 
+    @property
+    def losses(self):
+        # type: () -> dict
+        return self.loss_log.flush()
+
+    @losses.setter
+    def losses(self, losses):
+        # type: (dict) -> None
+        self.loss_log = LossAccumulator(losses, flush_interval=self._loss_flush_interval)
+
     def forward(self, x_t, a_t, x_tp1, **kwargs):
         # type: (torch.Tensor, torch.Tensor, torch.Tensor, dict) -> torch.Tensor
-        assert tuple(x_t.shape[-3:]) == self.x_dim, f'Received: {tuple(x_t.shape[1:])} {self.x_dim}'
+        assert tuple(x_t.shape[-len(self.x_dim):]) == self.x_dim, f'Received: {tuple(x_t.shape[1:])} {self.x_dim}'
         with torch.no_grad():
             intr_reward, *_ = self.model.forward(x_t, a_t, x_tp1, eval=True, **kwargs)
         return intr_reward
@@ -722,24 +771,42 @@ class WorldModelContrastive:
             x_tp1 = x_tp1.unsqueeze(0)
         # for i in range(10):
         #     self.train_contrastive_encoder(x_t, kwargs['memories'], positive_examples=x_tp1)
-        self.train_contrastive_encoder(x_t, kwargs['memories'], positive_examples=x_tp1)
-        int_reward = self.train_contrastive_fm(x_t, a_t, x_tp1, **kwargs)
+        if self.model.in_batch_negatives:
+            z_t, z_tp1 = self.model.encode_pair(x_t, x_tp1)
+            self.train_contrastive_encoder_in_batch(z_t, z_tp1)
+            int_reward = self.train_contrastive_fm(x_t, a_t, x_tp1, z_t=z_t, z_tp1=z_tp1, **kwargs)
+        else:
+            self.train_contrastive_encoder(x_t, kwargs['memories'], positive_examples=x_tp1)
+            int_reward = self.train_contrastive_fm(x_t, a_t, x_tp1, **kwargs)
         # int_reward = self.train_contrastive_enc_and_fm(x_t, a_t, x_tp1, **kwargs)
         return int_reward
 
     def train_contrastive_encoder(self, x_t, negative_examples, positive_examples=None):
         # type: (torch.Tensor, object, torch.Tensor) -> None
-        if isinstance(negative_examples, np.ndarray):
-            negative_examples = torch.from_numpy(negative_examples).to(dtype=torch.float32, device=self.device)
         if not isinstance(negative_examples, torch.Tensor):
-            negative_examples = torch.from_numpy(negative_examples.sample_states(
-                self.model.neg_samples)).to(dtype=torch.float32, device=self.device)
+            from utils.utils import state_to_torch  # Lazy, utils pulls in torchvision and cv2
+            if not isinstance(negative_examples, np.ndarray):
+                negative_examples = negative_examples.sample_states(self.model.neg_samples)
+            negative_examples = state_to_torch(negative_examples, self.device)
         self.optimizer_enc.zero_grad()
         loss = self.model.calculate_contrastive_loss(negative_examples, x_t=x_t, pos_examples=positive_examples)
         loss.backward()
         torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
         self.optimizer_enc.step()
-        self.losses['wm_ns_loss'].append(loss.item())
+        self.loss_log.append('wm_ns_loss', loss.detach())
+
+    def train_contrastive_encoder_in_batch(self, z_t, z_tp1):
+        # type: (torch.Tensor, torch.Tensor) -> None
+        """"
+        Contrastive encoder update that uses the rest of the batch as negatives, z_t and z_tp1 must still carry
+        their graph to the encoder.
+        """
+        self.optimizer_enc.zero_grad()
+        loss = self.model.calculate_in_batch_contrastive_loss(z_t, z_tp1)
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
+        self.optimizer_enc.step()
+        self.loss_log.append('wm_ns_loss', loss.detach())
 
     def train_contrastive_enc_and_fm(self, x_t, a_t, x_tp1, store_loss=True, **kwargs):
         # type: (torch.Tensor, torch.Tensor, torch.Tensor, bool, dict) -> torch.Tensor
@@ -752,8 +819,7 @@ class WorldModelContrastive:
         loss.backward()
         torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
         self.optimizer_wm.step()
-        for key in loss_items:
-            self.losses[key].append(loss_items[key])
+        self.loss_log.update(loss_items)
         if self._its_a_gridworld_bois and store_loss and 'distance' in kwargs:
             key = str(x_t.cpu().numpy().tolist()) + str(a_t.cpu().numpy().tolist())
             if key in self.state_wise_loss_diff:
@@ -767,15 +833,14 @@ class WorldModelContrastive:
                 self.state_wise_loss_diff[key] = {'d': kwargs['distance'], 'list': []}
         return intr_reward
 
-    def train_contrastive_fm(self, x_t, a_t, x_tp1, store_loss=True, **kwargs):
-        # type: (torch.Tensor, torch.Tensor, torch.Tensor, bool, dict) -> torch.Tensor
+    def train_contrastive_fm(self, x_t, a_t, x_tp1, store_loss=True, z_t=None, z_tp1=None, **kwargs):
+        # type: (torch.Tensor, torch.Tensor, torch.Tensor, bool, torch.Tensor, torch.Tensor, dict) -> torch.Tensor
         self.model.zero_grad()
-        intr_reward, loss, loss_items = self.model.forward_fm_only(x_t, a_t, x_tp1)
+        intr_reward, loss, loss_items = self.model.forward_fm_only(x_t, a_t, x_tp1, z_t=z_t, z_tp1=z_tp1)
         loss.backward()
         torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
         self.optimizer_wm.step()
-        for key in loss_items:
-            self.losses[key].append(loss_items[key])
+        self.loss_log.update(loss_items)
         if self._its_a_gridworld_bois and store_loss and 'distance' in kwargs:
             key = str(x_t.cpu().numpy().tolist()) + str(a_t.cpu().numpy().tolist())
             if key in self.state_wise_loss_diff:
@@ -813,7 +878,7 @@ class WorldModelContrastive:
         torch.save({'model': self.model,
                     'optimizer_wm': self.optimizer_wm,
                     'optimizer_enc': self.optimizer_enc,
-                    'losses': self.losses,
+                    'losses': losses_state_dict(self.losses),
                     'state_wise_loss': self.state_wise_loss,
                     'state_wise_loss_diff': self.state_wise_loss_diff
                     }, folder_path + 'wm_items.pt')
@@ -830,7 +895,7 @@ class WorldModelContrastive:
         self.model = checkpoint['model']
         self.optimizer_wm = checkpoint['optimizer_wm']
         self.optimizer_enc = checkpoint['optimizer_enc']
-        self.losses = checkpoint['losses']
+        self.losses = load_losses(checkpoint['losses'])
         self.state_wise_loss = checkpoint['state_wise_loss']
         self.state_wise_loss_diff = checkpoint['state_wise_loss_diff']
 
@@ -853,11 +918,22 @@ class WorldModelNoEncoder:
             raise NameError('What optimizer??')
         self.loss_func = torch.nn.MSELoss(reduction='none').to(self.device)
         self.train_steps = 0
-        self.losses = {'wm_loss': [], 'wm_pred_error': []}
+        self._loss_flush_interval = kwargs['export_interval']
+        self.losses = make_losses(('wm_loss', 'wm_pred_error'))
         self._its_a_gridworld_bois = kwargs['env_name'][:9] == 'GridWorld'
         self.state_wise_loss = {} if self._its_a_gridworld_bois else None
         self.state_wise_loss_diff = {} if self._its_a_gridworld_bois else None
 
+    @property
+    def losses(self):
+        # type: () -> dict
+        return self.loss_log.flush()
+
+    @losses.setter
+    def losses(self, losses):
+        # type: (dict) -> None
+        self.loss_log = LossAccumulator(losses, flush_interval=self._loss_flush_interval)
+
     def forward(self, x_t, a_t, x_tp1):
         # type: (torch.Tensor, torch.Tensor, torch.Tensor) -> torch.Tensor
         x_t, x_tp1, a_t = x_t.to(self.device), x_tp1.to(self.device), a_t.to(self.device)
@@ -887,8 +963,8 @@ class WorldModelNoEncoder:
             else:
                 self.state_wise_loss[key] = {'d': kwargs['distance'], 'list': [new_d.item()]}
                 self.state_wise_loss_diff[key] = {'d': kwargs['distance'], 'list': []}
-        self.losses['wm_loss'].append(loss.item())
-        self.losses['wm_pred_error'].append((x_tp1 - x_tp1_prime).abs().sum(dim=1).mean().item())
+        self.loss_log.append('wm_loss', loss.detach())
+        self.loss_log.append('wm_pred_error', (x_tp1 - x_tp1_prime).detach().abs().sum(dim=1).mean())
         self.train_steps += 1
         return intr_reward
 
@@ -906,7 +982,7 @@ class WorldModelNoEncoder:
         os.makedirs(folder_path, exist_ok=True)
         torch.save({'model': self.model.cpu(),
                     'optimizer_wm': self.optimizer,
-                    'losses': self.losses,
+                    'losses': losses_state_dict(self.losses),
                     'state_wise_loss': self.state_wise_loss,
                     'state_wise_loss_diff': self.state_wise_loss_diff
                     }, folder_path + 'wm_items.pt')
@@ -915,7 +991,7 @@ class WorldModelNoEncoder:
         checkpoint = torch.load(path)
         self.model = checkpoint['model']
         self.optimizer = checkpoint['optimizer_wm']
-        self.losses = checkpoint['losses']
+        self.losses = load_losses(checkpoint['losses'])
         self.state_wise_loss = checkpoint['state_wise_loss']
         self.state_wise_loss_diff = checkpoint['state_wise_loss_diff']
 
@@ -927,7 +1003,7 @@ class TabularWorldModel:
         self.predictions = {}
         self.lr = lr
         self.train_steps = 0
-        self.losses = {'wm_loss': []}
+        self.losses = make_losses(('wm_loss',))
         self._its_a_gridworld_bois = kwargs['env_name'][:9] == 'GridWorld'
         self.state_wise_loss = {} if self._its_a_gridworld_bois else None
         self.state_wise_loss_diff = {} if self._its_a_gridworld_bois else None
@@ -991,14 +1067,255 @@ class TabularWorldModel:
 
     def save(self, folder_path):
         os.makedirs(folder_path, exist_ok=True)
-        torch.save({'losses': self.losses,
+        torch.save({'losses': losses_state_dict(self.losses),
+                    'state_wise_loss': self.state_wise_loss,
+                    'state_wise_loss_diff': self.state_wise_loss_diff
+                    }, folder_path + 'wm_items.pt')
+
+    def load(self, path):
+        checkpoint = torch.load(path)
+        self.losses = load_losses(checkpoint['losses'])
+        self.state_wise_loss = checkpoint['state_wise_loss']
+        self.state_wise_loss_diff = checkpoint['state_wise_loss_diff']
+
+
+class StateIndex:
+    def __init__(self, obs_dim, index='hash'):
+        # type: (tuple, str) -> None
+        """"
+        Maps discrete states to integer row ids, either by argmax (one-hot states) or by a dict keyed on the raw bytes of
+        the state, which hands out ids in the order states are first seen.
+        """
+        assert index in {'argmax', 'hash'}, 'Unknown state index.'
+        self.obs_dim = obs_dim
+        self.index = index
+        self.ids = {}
+        self.capacity = obs_dim[0] if index == 'argmax' else 1024  # Initial number of rows of tables indexed by this
+
+    def __len__(self):
+        return self.obs_dim[0] if self.index == 'argmax' else len(self.ids)
+
+    def state_dict(self):
+        return {'ids': self.ids}
+
+    def load_state_dict(self, state_dict):
+        self.ids = state_dict['ids']
+
+    def __call__(self, s_t, add=False):
+        # type: (torch.Tensor, bool) -> torch.Tensor
+        """"
+        Row ids of a batch of states. Unseen states get id -1 unless add is True.
+        The hash index deduplicates the batch with np.unique first, so the dict is only looked up once per distinct
+        state of the batch, in the order they first occur.
+        """
+        if self.index == 'argmax':
+            return s_t.argmax(dim=1).cpu()
+        keys = np.ascontiguousarray(s_t.cpu().numpy(), dtype=np.float32).reshape((s_t.shape[0], int(np.prod(s_t.shape[1:]))))
+        keys = keys.view(np.dtype((np.void, keys.shape[1] * keys.itemsize))).reshape(-1)
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        unique_ids = np.empty(unique_keys.shape[0], dtype=np.int64)
+        for i in np.argsort(first):
+            key = unique_keys[i].tobytes()
+            if key not in self.ids and add:
+                self.ids[key] = len(self.ids)
+            unique_ids[i] = self.ids.get(key, -1)
+        return torch.from_numpy(unique_ids[inverse.reshape(-1)])
+
+
+class SimHashIndex:
+    EMPTY = -1
+
+    def __init__(self, obs_dim, bits=16, table_size=2 ** 17, seed=0):
+        # type: (tuple, int, int, int) -> None
+        """"
+        Maps continuous states (e.g. encoder latents) to row ids by SimHash: states are projected with a fixed random
+        matrix and the signs of the projections form a k-bit code. Codes are stored in a fixed-size open-addressing table
+        with linear probing, so nearby states share a row and memory stays bounded.
+        """
+        assert 0 < bits <= 62, 'Codes must fit in a signed 64 bit integer.'
+        assert table_size > 0 and table_size & (table_size - 1) == 0, 'Table size must be a power of 2.'
+        if 2 ** bits >= table_size:
+            # Every possible code needs its own slot, plus an empty one which ends the probing of unseen codes
+            raise ValueError(f'A SimHash table of {table_size} slots cannot hold all {2 ** bits} codes of {bits} bits. '
+                             f'Use a table of at least {2 ** (bits + 1)} slots or fewer bits.')
+        self.obs_dim = obs_dim
+        self.capacity = table_size
+        generator = torch.Generator().manual_seed(seed)
+        self.projection = torch.randn((int(np.prod(obs_dim)), bits), generator=generator)
+        self._bit_values = 2 ** np.arange(bits, dtype=np.int64)
+        self.keys = np.full(table_size, self.EMPTY, dtype=np.int64)
+        self.num_codes = 0
+
+    def __len__(self):
+        return self.capacity
+
+    def codes(self, s_t):
+        # type: (torch.Tensor) -> np.ndarray
+        """"
+        SimHash codes of a batch of states, computed with a single matrix multiply.
+        """
+        bits = s_t.reshape((len(s_t), -1)).to(dtype=torch.float32) @ self.projection.to(s_t.device) > 0
+        return bits.cpu().numpy() @ self._bit_values
+
+    def _slots(self, codes):
+        # type: (np.ndarray) -> np.ndarray
+        # Fibonacci hashing spreads codes which only differ in their low bits over the whole table
+        return ((codes.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)).astype(np.int64) & (self.capacity - 1)
+
+    def __call__(self, s_t, add=False):
+        # type: (torch.Tensor, bool) -> torch.Tensor
+        """"
+        Row ids of a batch of states. States whose code is not in the table get id -1 unless add is True.
+        """
+        codes, inverse = np.unique(self.codes(s_t), return_inverse=True)
+        ids = np.full(len(codes), -1, dtype=np.int64)
+        slots = self._slots(codes)
+        pending = np.arange(len(codes))
+        for _ in range(self.capacity):
+            if len(pending) == 0:
+                break
+            keys = self.keys[slots[pending]]
+            found = keys == codes[pending]
+            ids[pending[found]] = slots[pending[found]]
+            empty = keys == self.EMPTY
+            if add and empty.any():
+                # Codes probing the same empty slot in this round: the first one claims it, the others keep probing
+                claimants = pending[empty]
+                _, first = np.unique(slots[claimants], return_index=True)
+                claimed = claimants[first]
+                self.keys[slots[claimed]] = codes[claimed]
+                ids[claimed] = slots[claimed]
+                self.num_codes += len(claimed)
+                done = found.copy()
+                done[np.flatnonzero(empty)[first]] = True
+            else:
+                done = found | empty  # Without add, an empty slot means the code is unseen
+            pending = pending[~done]
+            slots[pending] = (slots[pending] + 1) & (self.capacity - 1)
+        return torch.from_numpy(ids[inverse.reshape(-1)])
+
+    def state_dict(self):
+        return {'projection': self.projection, 'keys': torch.from_numpy(self.keys), 'num_codes': self.num_codes}
+
+    def load_state_dict(self, state_dict):
+        self.projection = state_dict['projection']
+        self.keys = state_dict['keys'].numpy()
+        self.num_codes = state_dict['num_codes']
+
+
+def make_state_index(obs_dim, index, simhash_bits=16, simhash_table_size=2 ** 17, seed=0, **kwargs):
+    # type: (tuple, str, int, int, int, dict) -> object
+    if index == 'simhash':
+        return SimHashIndex(obs_dim, simhash_bits, simhash_table_size, seed)
+    return StateIndex(obs_dim, index)
+
+
+def grow_rows(table, num_rows):
+    # type: (torch.Tensor, int) -> torch.Tensor
+    """"
+    Return table with at least num_rows rows, at least doubling its size if it has to grow.
+    """
+    if num_rows <= len(table):
+        return table
+    grown = torch.zeros((max(2 * len(table), num_rows), *table.shape[1:]), dtype=table.dtype)
+    grown[:len(table)] = table
+    return grown
+
+
+class ArrayTabularWorldModel:
+    def __init__(self, obs_dim, a_dim, lr=0.001, index='hash', **kwargs):
+        # type: (tuple, tuple, float, str, dict) -> None
+        """"
+        TabularWorldModel with the predictions of all states kept in one [num_states, a_dim, obs_dim] tensor, whose rows
+        are given by a StateIndex or SimHashIndex.
+        """
+        self.obs_dim = obs_dim
+        self.a_dim = a_dim
+        self.state_index = make_state_index(obs_dim, index, **kwargs)
+        self.predictions = torch.zeros((self.state_index.capacity, a_dim[0], *obs_dim))
+        self.lr = lr
+        self.train_steps = 0
+        self.losses = make_losses(('wm_loss',))
+        self._its_a_gridworld_bois = kwargs['env_name'][:9] == 'GridWorld'
+        self.state_wise_loss = {} if self._its_a_gridworld_bois else None
+        self.state_wise_loss_diff = {} if self._its_a_gridworld_bois else None
+
+    def train_batch(self, s_t, a_t, s_tp1):
+        # type: (torch.Tensor, torch.Tensor, torch.Tensor) -> torch.Tensor
+        """"
+        Update the predictions of a batch of (s, a) pairs with one vectorized write. Updates of pairs that occur more
+        than once in the batch are summed, all of them computed from the predictions before the update.
+        """
+        s_t, a_t, s_tp1 = s_t.cpu(), a_t.cpu().reshape(-1), s_tp1.cpu()
+        ids = self.state_index(s_t, add=True)
+        self.predictions = grow_rows(self.predictions, len(self.state_index))
+        error = s_tp1 - (s_t + self.predictions[ids, a_t])
+        r_int = error.pow(2.0).sum(dim=1)
+        self.predictions.index_put_((ids, a_t), self.lr * error, accumulate=True)
+        self.train_steps += 1
+        return r_int
+
+    def train(self, s_t, a_t, s_tp1, store_loss=True, **kwargs):
+        # type: (torch.Tensor, torch.Tensor, torch.Tensor, bool, dict) -> torch.Tensor
+        assert len(s_t.shape) == 1
+        assert len(a_t.shape) == 1
+        if len(s_tp1.shape) == 2:
+            s_tp1 = s_tp1.squeeze(0)
+        assert len(s_tp1.shape) == 1
+        r_int = self.train_batch(s_t.unsqueeze(0), a_t[:1], s_tp1.unsqueeze(0))[0]
+        if self._its_a_gridworld_bois and store_loss and 'distance' in kwargs:
+            key = (self.state_index(s_t.unsqueeze(0)).item(), a_t[0].item())
+            if key in self.state_wise_loss_diff:
+                self.state_wise_loss_diff[key]['list'].append(abs(self.state_wise_loss[key]['list'][-1] - r_int.item()))
+            new_d = (s_tp1 - (s_t + self.predictions[key])).pow(2.0).sum()
+            if key in self.state_wise_loss:
+                self.state_wise_loss[key]['list'].append(new_d.item())
+            else:
+                self.state_wise_loss[key] = {'d': kwargs['distance'], 'list': [new_d.item()]}
+                self.state_wise_loss_diff[key] = {'d': kwargs['distance'], 'list': []}
+        self.losses['wm_loss'].append(r_int)
+        return r_int
+
+    def forward(self, s_t, a_t, s_tp1):
+        # type: (torch.Tensor, torch.Tensor, torch.Tensor) -> torch.Tensor
+        """"
+        Batched version of TabularWorldModel.forward, 1D inputs are treated as a batch of one.
+        """
+        single = len(s_t.shape) == 1
+        s_t, a_t, s_tp1 = s_t.cpu().reshape((-1, *self.obs_dim)), a_t.cpu().reshape(-1), s_tp1.cpu().reshape((-1, *self.obs_dim))
+        ids = self.state_index(s_t)
+        seen = ids >= 0
+        error = s_tp1.clone()
+        error[seen] -= self.predictions[ids[seen], a_t[seen]]
+        r_int = error.pow(2.0).sum(dim=1)
+        return r_int[0] if single else r_int
+
+    def next(self, s_t, a_t):
+        # type: (torch.Tensor, torch.Tensor) -> torch.Tensor
+        assert len(s_t.shape) == 1
+        assert len(a_t.shape) == 1
+        idx = self.state_index(s_t.unsqueeze(0)).item()
+        if idx < 0:
+            return torch.zeros(self.obs_dim)
+        return self.predictions[idx, a_t[0]]
+
+    def get_losses(self):
+        return self.losses
+
+    def save(self, folder_path):
+        os.makedirs(folder_path, exist_ok=True)
+        torch.save({'predictions': self.predictions,
+                    'state_index': self.state_index.state_dict(),
+                    'losses': losses_state_dict(self.losses),
                     'state_wise_loss': self.state_wise_loss,
                     'state_wise_loss_diff': self.state_wise_loss_diff
                     }, folder_path + 'wm_items.pt')
 
     def load(self, path):
         checkpoint = torch.load(path)
-        self.losses = checkpoint['losses']
+        self.predictions = checkpoint['predictions']
+        self.state_index.load_state_dict(checkpoint['state_index'])
+        self.losses = load_losses(checkpoint['losses'])
         self.state_wise_loss = checkpoint['state_wise_loss']
         self.state_wise_loss_diff = checkpoint['state_wise_loss_diff']
 
@@ -1009,7 +1326,7 @@ class CountBasedWorldModel:
         self.a_dim = a_dim
         self.predictions = {}
         self.train_steps = 0
-        self.losses = {'wm_loss': []}
+        self.losses = make_losses(('wm_loss',))
 
     def train(self, s_t, a_t, s_tp1, **kwargs):
         # type: (torch.Tensor, torch.Tensor, torch.Tensor, dict) -> torch.Tensor
@@ -1030,4 +1347,106 @@ class CountBasedWorldModel:
         return torch.tensor(r_int)
 
     def save(self, folder_path):
-        pass
+        os.makedirs(folder_path, exist_ok=True)
+        torch.save({'predictions': self.predictions,
+                    'losses': losses_state_dict(self.losses)
+                    }, folder_path + 'wm_items.pt')
+
+    def load(self, path):
+        checkpoint = torch.load(path)
+        self.predictions = checkpoint['predictions']
+        self.losses = load_losses(checkpoint['losses'])
+
+
+class ArrayCountBasedWorldModel:
+    def __init__(self, obs_dim, a_dim, index='hash', bonus='inverse', **kwargs):
+        # type: (tuple, tuple, str, str, dict) -> None
+        """"
+        CountBasedWorldModel with the visitation counts of all (s, a) pairs kept in one [num_states, a_dim] tensor, whose
+        rows are given by a StateIndex or SimHashIndex. Takes whole batches and rewards each transition with 1/n
+        ('inverse') or 1/sqrt(n) ('inverse_sqrt') of its count n after the update.
+        """
+        assert bonus in {'inverse', 'inverse_sqrt'}, 'Unknown count bonus.'
+        self.obs_dim = obs_dim
+        self.a_dim = a_dim
+        self.train_steps = 0
+        self._loss_flush_interval = kwargs['export_interval']
+        self.losses = make_losses(('wm_loss',))
+        self.bonus = bonus
+        self.state_index = make_state_index(obs_dim, index, **kwargs)
+        self.counts = torch.zeros((self.state_index.capacity, a_dim[0]), dtype=torch.long)
+
+    @property
+    def losses(self):
+        # type: () -> dict
+        return self.loss_log.flush()
+
+    @losses.setter
+    def losses(self, losses):
+        # type: (dict) -> None
+        self.loss_log = LossAccumulator(losses, flush_interval=self._loss_flush_interval)
+
+    def _bonus(self, n):
+        # type: (torch.Tensor) -> torch.Tensor
+        if self.bonus == 'inverse':
+            return n.to(dtype=torch.float32).reciprocal()
+        return n.to(dtype=torch.float32).rsqrt()
+
+    def train(self, s_t, a_t, s_tp1, **kwargs):
+        # type: (torch.Tensor, torch.Tensor, torch.Tensor, dict) -> torch.Tensor
+        single = len(s_t.shape) == 1
+        ids = self.state_index(s_t.reshape((-1, *self.obs_dim)), add=True)
+        a_t = a_t.cpu().reshape(-1)
+        self.counts = grow_rows(self.counts, len(self.state_index))
+        self.counts.index_put_((ids, a_t), torch.ones_like(ids), accumulate=True)
+        r_int = self._bonus(self.counts[ids, a_t])
+        self.loss_log.append('wm_loss', r_int.mean())
+        self.train_steps += 1
+        return r_int[0] if single else r_int.to(s_t.device)
+
+    def forward(self, s_t, a_t, s_tp1):
+        # type: (torch.Tensor, torch.Tensor, torch.Tensor) -> torch.Tensor
+        """"
+        Reward the transitions would get if they were trained on now, without updating the counts.
+        """
+        single = len(s_t.shape) == 1
+        ids = self.state_index(s_t.reshape((-1, *self.obs_dim)))
+        a_t = a_t.cpu().reshape(-1)
+        n = torch.zeros_like(ids)
+        seen = ids >= 0
+        n[seen] = self.counts[ids[seen], a_t[seen]]
+        r_int = self._bonus(n + 1)
+        return r_int[0] if single else r_int.to(s_t.device)
+
+    def save(self, folder_path):
+        os.makedirs(folder_path, exist_ok=True)
+        torch.save({'counts': self.counts,
+                    'state_index': self.state_index.state_dict(),
+                    'losses': losses_state_dict(self.losses)
+                    }, folder_path + 'wm_items.pt')
+
+    def load(self, path):
+        checkpoint = torch.load(path)
+        self.counts = checkpoint['counts']
+        self.state_index.load_state_dict(checkpoint['state_index'])
+        self.losses = load_losses(checkpoint['losses'])
+
+
+def tabular_world_model(x_dim, a_dim, **kwargs):
+    """"
+    String keyed TabularWorldModel or its array backed version, depending on tab_index. Use simhash for continuous
+    encoder latents.
+    """
+    if kwargs['tab_index'] == 'str':
+        return TabularWorldModel(x_dim, a_dim, kwargs['wm_lr'], **kwargs)
+    return ArrayTabularWorldModel(x_dim, a_dim, kwargs['wm_lr'], index=kwargs['tab_index'], **kwargs)
+
+
+def count_world_model(x_dim, a_dim, **kwargs):
+    """"
+    String keyed CountBasedWorldModel or its array backed version, depending on tab_index. Use simhash for continuous
+    encoder latents.
+    """
+    if kwargs['tab_index'] == 'str':
+        return CountBasedWorldModel(x_dim, a_dim, **kwargs)
+    return ArrayCountBasedWorldModel(x_dim, a_dim, index=kwargs['tab_index'], bonus=kwargs['count_bonus'], **kwargs)
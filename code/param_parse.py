@@ -14,6 +14,9 @@ def parse_args():
     parser.add_argument('--export_interval', type=int, default=500)
     parser.add_argument('--eval_interval', type=int, default=int(2e4))
     parser.add_argument('--buffer_size', type=int, default=int(8e4))
+    parser.add_argument('--buffer_dir', help='If given, keep the replay buffer in memory-mapped files in this folder', type=str, default='')
+    parser.add_argument('--buffer_load_path', help='If given, restore the replay buffer snapshot in this folder instead of filling it', type=str, default='')
+    parser.add_argument('--prefetch_batches', help='Batches sampled ahead by a background thread, 0 samples in the main loop', type=int, default=0)
     parser.add_argument('--train_steps', type=int, default=int(3e6))
     parser.add_argument('--gamma', type=float, default=0.99)
     parser.add_argument('--eps_static', type=bool, default=True)
@@ -23,6 +26,7 @@ def parse_args():
     parser.add_argument('--batch_size', type=int, default=32)
     parser.add_argument('--alg_target_net_steps', type=int, default=1000)
     parser.add_argument('--alg_soft_target', type=bool, default=False)
+    parser.add_argument('--alg_tau', type=float, default=0.01)
     parser.add_argument('--alg_lr', type=float, default=1e-4)
     parser.add_argument('--z_dim', type=str, default='(32,)')
     parser.add_argument('--wm_h_dim', type=str, default='(64,)')
@@ -39,14 +43,25 @@ def parse_args():
 
     parser.add_argument('--encoder_type', type=str, default="random",
                         choices=['none', 'random', 'cont', 'idf', 'vae'])
-    parser.add_argument('--wm_type', type=str, default="count",
-                        choices=['tab', 'nn', 'count'])
+    parser.add_argument('--wm_type', help='array_count is the batched count model of the DQN grid driver, it needs a tab_index other than str', type=str,
+                        default="count", choices=['tab', 'nn', 'count', 'array_count'])
+    parser.add_argument('--tab_index', help='How the tabular and count world models index states', type=str, default='str',
+                        choices=['str', 'argmax', 'hash', 'simhash'])
+    parser.add_argument('--simhash_bits', help='Length of the SimHash codes of continuous states', type=int, default=16)
+    parser.add_argument('--simhash_table_size', help='Number of slots of the SimHash table', type=int, default=2 ** 17)
+    parser.add_argument('--count_bonus', help='Intrinsic reward of a count n', type=str, default='inverse',
+                        choices=['inverse', 'inverse_sqrt'])
     # parser.add_argument('--encoder_load_path', type=str, default='final_results/GridWorld42x42-v0/2020-07-25_04-28-46-261670_-_pretrain_cont_2/')
     parser.add_argument('--encoder_load_path', type=str, default='')
     parser.add_argument('--decoder', type=bool, default=False)
     parser.add_argument('--resize_dim', type=str, default='(84, 84)')
     parser.add_argument('--grayscale', type=bool, default=True)
     parser.add_argument('--frame_stack', type=int, default=4)
+    parser.add_argument('--obs_uint8', help='Store raw uint8 frames, scaled to float at sample time', action='store_true')
+    parser.add_argument('--relabel_interval', help='Train steps between re-scoring the intrinsic rewards of the whole buffer, '
+                                                   '0 uses the rewards of the world model update instead', type=int, default=0)
+    parser.add_argument('--tensor_buffer', help='Keep the replay buffer in preallocated tensors on the model device', action='store_true')
+    parser.add_argument('--cache_latents', help='Store latents of the frozen random encoder in the replay buffer', action='store_true')
     parser.add_argument('--conv_layers', type=tuple, default=CONV_LAYERS2015)
     parser.add_argument('--stochastic_latent', type=bool, default=False)
     parser.add_argument('--encoder_batchnorm', type=bool, default=False)
@@ -55,7 +70,8 @@ def parse_args():
     parser.add_argument('--hinge_value', type=float, default=0.1)
     parser.add_argument('--idf_inverse_hdim', type=str, default='(64,)')
 
-    parser.add_argument('--gridworld_ns_pool', type=str, default="uniform", choices=['visited', 'uniform', 'visited_uniform'])
+    parser.add_argument('--gridworld_ns_pool', help='Negative samples of the contrastive encoder, batch uses the rest of the training batch',
+                        type=str, default="uniform", choices=['visited', 'uniform', 'visited_uniform', 'batch'])
 
     args = parser.parse_args().__dict__
     args['time_stamp'] = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
@@ -2,10 +2,11 @@
 import torch
 import gym
 import numpy as np
-from modules.replay_buffers.replay_buffer import DynamicsReplayBuffer, ReplayBuffer
+from modules.replay_buffers.replay_buffer import ArrayDynamicsReplayBuffer
+from modules.replay_buffers.prefetcher import BatchPrefetcher
 from modules.algorithms.DQN import DQN
 from modules.world_models.world_model import EncodedWorldModel, WorldModelNoEncoder
-from utils.utils import standardize_state, transition_to_torch_no_r, CONV_LAYERS2014
+from utils.utils import standardize_state, transition_to_torch_no_r, relabel_intrinsic_rewards, CONV_LAYERS2014
 from utils.visualise import Visualise
 from datetime import datetime
 import os
@@ -123,7 +124,7 @@ def warmup_wm(alg, wm, buffer, visualise, **kwargs):
         obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch = transition_to_torch_no_r(*batch)
         r_int_t = wm.train(obs_t_batch, a_t_batch, obs_tp1_batch, **{'memories': buffer})
         if alg.train_steps % kwargs['interval'] == 0:
-            visualise.eval_wm_warmup(i, **{k: np.mean(i[-100:]) for k, i in wm.losses.items() if i != []})
+            visualise.eval_wm_warmup(i, **{k: i.mean() for k, i in wm.losses.items() if len(i) > 0})
 
 
 def evaluate(env_name, alg, wm, obs_dim, n=3):
@@ -160,7 +161,9 @@ def evaluate(env_name, alg, wm, obs_dim, n=3):
 
 
 def main(env, visualise, folder_name, **kwargs):
-    buffer = DynamicsReplayBuffer(kwargs['buffer_size'])
+    buffer = ArrayDynamicsReplayBuffer(kwargs['buffer_size'], seed=kwargs['seed'])
+    if kwargs['buffer_load_path'] != '':
+        buffer.load(kwargs['buffer_load_path'])
     obs_dim = env.observation_space.sample().shape
     assert len(obs_dim) == 1, 'States should be 1D vector.'
     a_dim = (env.action_space.n,)
@@ -180,6 +183,11 @@ def main(env, visualise, folder_name, **kwargs):
     fill_buffer(env, alg, buffer, **kwargs)
     if kwargs['wm_warmup_steps'] > 0:
         warmup_wm(alg, wm, buffer, visualise, **kwargs)
+    relabel = kwargs['relabel_interval'] > 0
+    prefetcher = None
+    if kwargs['prefetch_batches'] > 0:
+        prefetcher = BatchPrefetcher(buffer, kwargs['batch_size'], transition_to_torch_no_r,
+                                     queue_size=kwargs['prefetch_batches'], pin_memory=device == 'cuda')
     while alg.train_steps < kwargs['train_steps']:
         s_t = env.reset()
         s_t = s_t / 256.0
@@ -192,18 +200,26 @@ def main(env, visualise, folder_name, **kwargs):
             s_tp1 = s_tp1 / 256.0
             total[0] += r_t
             total[1] += 1
-            buffer.add(s_t, a_t, s_tp1, done)
+            if prefetcher is not None:
+                prefetcher.add(s_t, a_t, s_tp1, done)
+            else:
+                buffer.add(s_t, a_t, s_tp1, done)
             s_t = s_tp1
             # env.render('human')
             if alg.train_steps < kwargs['train_steps']:
-                batch = buffer.sample(kwargs['batch_size'])
-                obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch = transition_to_torch_no_r(*batch)
+                if prefetcher is not None:
+                    obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch = prefetcher.get()
+                else:
+                    batch = buffer.sample(kwargs['batch_size'])
+                    obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch = transition_to_torch_no_r(*batch)
                 r_int_t = wm.train(obs_t_batch, a_t_batch, obs_tp1_batch, **{'memories': buffer})
                 total_history['int']['mean'].append(r_int_t.mean().item())
                 intr_reward_bookkeeping(r_int_t, total_history, intr_rew_norm, kwargs['intr_rew_mean_n'])
                 if intr_rew_norm is not None:
                     r_int_t = normalize_rewards(r_int_t, total_history, intr_rew_norm)
                 alg.train(obs_t_batch, a_t_batch, r_int_t, obs_tp1_batch, dones_batch)
+                if relabel and alg.train_steps % kwargs['relabel_interval'] == 0:
+                    relabel_intrinsic_rewards(buffer, wm)
 
                 if done:
                     total_history['ext'].append(total[0])
@@ -220,15 +236,19 @@ def main(env, visualise, folder_name, **kwargs):
                           f'Eps: {alg.epsilon:.3f}',
                           'Time elapsed:', f'{elapsed_time[0]}:{elapsed_time[1]}:{elapsed_time[2]}')
 
+                    alg.flush_losses()
                     visualise.train_iteration_update(ext=ep_scores['DQN'][-1],
                                                      int=ep_scores['Mean intrinsic reward'][-1],
-                                                     **{k: np.mean(i[-100:]) for k, i in wm.losses.items() if i != []},
-                                                     alg_loss=np.mean(alg.losses[-100:]))
+                                                     **{k: i.mean() for k, i in wm.losses.items() if len(i) > 0},
+                                                     alg_loss=alg.losses.mean())
                 if alg.train_steps % kwargs['eval_interval'] == 0:
                     os.makedirs(folder_name + 'objects/', exist_ok=True)
                     wm.save(path=f'{folder_name}objects/WM.pt')
                     alg.save(path=f'{folder_name}objects/DQN.pt')
+                    buffer.save(f'{folder_name}objects/replay_buffer/')
                     visualise.eval_iteration_update(**evaluate(kwargs['env_name'], alg, wm, obs_dim))
+    if prefetcher is not None:
+        prefetcher.close()
     print('Environment closed.')
     visualise.close()
     print('Tensorboard writer closed.')
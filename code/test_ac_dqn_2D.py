@@ -2,10 +2,12 @@
 import torch
 import gym
 import numpy as np
-from modules.replay_buffers.replay_buffer import DynamicsReplayBuffer
+from modules.replay_buffers.replay_buffer import FrameStackReplayBuffer, MemmapFrameStackReplayBuffer, \
+    LatentFrameStackReplayBuffer, MemmapLatentFrameStackReplayBuffer, MemmapBuffer
+from modules.replay_buffers.prefetcher import BatchPrefetcher
 from modules.algorithms.DQN import DQN
 from modules.world_models.world_model import EncodedWorldModel, WorldModelNoEncoder, WorldModelContrastive
-from utils.utils import standardize_state, transition_to_torch_no_r
+from utils.utils import standardize_state, state_to_torch, transition_to_torch_no_r
 from utils.visualise import Visualise
 from datetime import datetime
 import os
@@ -74,39 +76,37 @@ def normalize_rewards(r_int_t, history, norm_type):
         return (r_int_t - r_mean) / r_std
 
 
-def step(env, a_t, s_t, obs_dim):
+def step(env, a_t, s_t, obs_dim, uint8=False):
     """"
     Add the new frame to the top of the stack.
     """
     new_frame, r_t, done, info = env.step(a_t)
-    new_frame = standardize_state(new_frame, obs_dim, grayscale=True)
+    new_frame = standardize_state(new_frame, obs_dim, grayscale=True, uint8=uint8)
     s_tp1 = np.concatenate((s_t[1:], new_frame), axis=0)  # Oldest frame is at index 0
     return s_tp1, r_t, done, info
 
 
-def reset(env, obs_dim):
+def reset(env, obs_dim, uint8=False):
     new_frame = env.reset()
-    new_frame = standardize_state(new_frame, obs_dim, grayscale=True)
-    s_t = np.zeros(obs_dim)
+    new_frame = standardize_state(new_frame, obs_dim, grayscale=True, uint8=uint8)
+    s_t = np.zeros(obs_dim, dtype=new_frame.dtype)
     s_t[-1] = new_frame
     return s_t
 
 
-def evaluate(env_name, alg, wm, obs_dim, n=3):
+def evaluate(env_name, alg, wm, obs_dim, n=3, uint8=False):
     print('Evaluating...', end='\r')
     eval_start = datetime.now()
     env = gym.make(env_name)
     returns = {'ext': [], 'int': [], 'len': []}
     for i in range(n):
-        s_t = reset(env, obs_dim)
-        s_t = torch.from_numpy(s_t).to(dtype=torch.float32)
+        s_t = reset(env, obs_dim, uint8)
         done = False
         total = {'ext': 0.0, 'int': 0.0, 'len': 0}
         while not done:
-            a_t = alg.act(s_t, eval=True).item()
-            s_tp1, r_ext_t, done, info = step(env, a_t, s_t, obs_dim)
-            s_tp1 = torch.from_numpy(s_tp1).to(dtype=torch.float32)
-            r_int_t = wm.forward(s_t, torch.tensor([a_t, ]), s_tp1)
+            a_t = alg.act(state_to_torch(s_t), eval=True).item()
+            s_tp1, r_ext_t, done, info = step(env, a_t, s_t, obs_dim, uint8)
+            r_int_t = wm.forward(state_to_torch(s_t), torch.tensor([a_t, ]), state_to_torch(s_tp1))
             s_t = s_tp1
             total['ext'] += r_ext_t
             total['int'] += r_int_t.item()
@@ -127,23 +127,44 @@ def fill_buffer(env, alg, buffer, obs_dim, **kwargs):
     print('Filling buffer')
     eval_start = datetime.now()
     while len(buffer) < kwargs['buffer_size']:
-        s_t = reset(env, obs_dim)
-        done = False
+        s_t = reset(env, obs_dim, kwargs['obs_uint8'])
+        done, new_episode = False, True
         while not done:
-            a_t = alg.act(torch.from_numpy(s_t).to(dtype=torch.float32), eps=1.0).item()
-            s_tp1, r_t, done, info = step(env, a_t, s_t, obs_dim)
-            buffer.add(s_t, a_t, s_tp1, done)
+            a_t = alg.act(state_to_torch(s_t), eps=1.0).item()
+            s_tp1, r_t, done, info = step(env, a_t, s_t, obs_dim, kwargs['obs_uint8'])
+            buffer.add(s_t, a_t, s_tp1, done, new_episode=new_episode)
             if len(buffer) >= kwargs['buffer_size']:
                 break
-            s_t = s_tp1
+            s_t, new_episode = s_tp1, False
     print(f'Buffer fill time: {(datetime.now() - eval_start).total_seconds()}s.')
 
 
+def create_buffer(wm, device, **kwargs):
+    """"
+    Frame-stack replay buffer, kept in memory-mapped files if buffer_dir is given. With cache_latents the latents of the
+    frozen random encoder are computed once per observation and stored in the buffer.
+    """
+    buffer_args = {'frame_stack': kwargs['frame_stack'], 'seed': kwargs['seed']}
+    if kwargs['cache_latents']:
+        assert kwargs['encoder_type'] == 'random', 'Only latents of frozen random encoders can be cached.'
+        assert not kwargs['encoder_batchnorm'], 'Batchnorm statistics keep changing, so latents of the encoder would go stale.'
+        buffer_args['encoder'] = lambda s: wm.encode(state_to_torch(s).unsqueeze(0).to(device)).cpu().numpy()[0]
+        buffer_classes = (LatentFrameStackReplayBuffer, MemmapLatentFrameStackReplayBuffer)
+    else:
+        buffer_classes = (FrameStackReplayBuffer, MemmapFrameStackReplayBuffer)
+    if kwargs['buffer_dir'] != '':
+        buffer = buffer_classes[1](kwargs['buffer_size'], kwargs['buffer_dir'], **buffer_args)
+    else:
+        buffer = buffer_classes[0](kwargs['buffer_size'], **buffer_args)
+    if kwargs['buffer_load_path'] != '':
+        buffer.load(kwargs['buffer_load_path'])
+    return buffer
+
+
 def main(env, visualise, folder_name, **kwargs):
     shutil.copyfile(os.path.abspath(__file__), folder_name + 'test_ac_dqn_2D.py')
     shutil.copyfile(os.path.dirname(os.path.realpath(__file__)) + '/modules/world_models/world_model.py',
                     folder_name + 'world_model.py')
-    buffer = DynamicsReplayBuffer(kwargs['buffer_size'])
     obs_dim = (kwargs['frame_stack'] if kwargs['grayscale'] else 3 * kwargs['frame_stack'], *kwargs['resize_dim'])
     # obs_dim = env.observation_space.sample().shape
     assert len(obs_dim) == 3, 'States should be image (C, W, H).'
@@ -160,6 +181,7 @@ def main(env, visualise, folder_name, **kwargs):
         wm = EncodedWorldModel(obs_dim, a_dim, device=device, **kwargs)
     else:
         raise NotImplementedError
+    buffer = create_buffer(wm, device, **kwargs)
     intr_rew_norm = set_intr_rew_norm_type(kwargs['intr_rew_norm_type'])
     ep_scores = {'DQN': [0.0], 'Mean intrinsic reward': [0.0]}
     start_time = datetime.now()
@@ -168,28 +190,40 @@ def main(env, visualise, folder_name, **kwargs):
                                                       'min': {'list': [], 'running_mean': 0.0},
                                                       'max': {'list': [], 'running_mean': 0.0}}}
     fill_buffer(env, alg, buffer, obs_dim, **kwargs)
-    visualise.eval_iteration_update(**evaluate(kwargs['env_name'], alg, wm, obs_dim))
+    visualise.eval_iteration_update(**evaluate(kwargs['env_name'], alg, wm, obs_dim, uint8=kwargs['obs_uint8']))
     print('Training...')
+    prefetcher = None
+    if kwargs['prefetch_batches'] > 0:
+        prefetcher = BatchPrefetcher(buffer, kwargs['batch_size'], transition_to_torch_no_r,
+                                     queue_size=kwargs['prefetch_batches'], pin_memory=device == 'cuda')
     while alg.train_steps < kwargs['train_steps']:
-        s_t = reset(env, obs_dim)
+        s_t = reset(env, obs_dim, kwargs['obs_uint8'])
         done = False
         total = [0, 0]
         while not done:
-            a_t = alg.act(torch.from_numpy(s_t).to(dtype=torch.float32)).item()
-            s_tp1, r_t, done, info = step(env, a_t, s_t, obs_dim)
+            a_t = alg.act(state_to_torch(s_t)).item()
+            s_tp1, r_t, done, info = step(env, a_t, s_t, obs_dim, kwargs['obs_uint8'])
+            if prefetcher is not None:
+                prefetcher.add(s_t, a_t, s_tp1, done, new_episode=total[1] == 0)
+            else:
+                buffer.add(s_t, a_t, s_tp1, done, new_episode=total[1] == 0)
             total[0] += r_t
             total[1] += 1
-            buffer.add(s_t, a_t, s_tp1, done)
             if alg.train_steps < kwargs['train_steps']:
-                batch = buffer.sample(kwargs['batch_size'])
-                obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch = transition_to_torch_no_r(*batch)
-                r_int_t = wm.train(obs_t_batch, a_t_batch, obs_tp1_batch, **{'memories': buffer})
+                if prefetcher is not None:
+                    obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch, *latents = prefetcher.get()
+                else:
+                    batch = buffer.sample(kwargs['batch_size'])
+                    obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch, *latents = transition_to_torch_no_r(*batch)
+                wm_args = {'memories': buffer}
+                if latents:
+                    wm_args['z_t'], wm_args['z_tp1'] = latents
+                r_int_t = wm.train(obs_t_batch, a_t_batch, obs_tp1_batch, **wm_args)
                 intr_reward_bookkeeping(r_int_t, total_history, intr_rew_norm, kwargs['intr_rew_mean_n'])
                 if intr_rew_norm is not None:
                     r_int_t = normalize_rewards(r_int_t, total_history, intr_rew_norm)
                 alg.train(obs_t_batch, a_t_batch, r_int_t, obs_tp1_batch, dones_batch)
                 alg.train_steps += 1
-                alg.losses.append(0.0)
 
                 if done:
                     total_history['ext'].append(total[0])
@@ -206,16 +240,23 @@ def main(env, visualise, folder_name, **kwargs):
                           f'Eps: {alg.epsilon:.3f}',
                           'Time elapsed:', f'{elapsed_time[0]}:{elapsed_time[1]}:{elapsed_time[2]}')
 
+                    alg.flush_losses()
                     visualise.train_iteration_update(ext=ep_scores['DQN'][-1],
                                                      int=ep_scores['Mean intrinsic reward'][-1],
-                                                     **{k: np.mean(i[-100:]) for k, i in wm.losses.items() if i != []},
-                                                     alg_loss=np.mean(alg.losses[-100:]))
+                                                     **{k: i.mean() for k, i in wm.losses.items() if len(i) > 0},
+                                                     alg_loss=alg.losses.mean())
                 if alg.train_steps % kwargs['eval_interval'] == 0:
                     wm.save(f'{folder_name}saved_objects/')
                     alg.save(f'{folder_name}saved_objects/')
-                    visualise.eval_iteration_update(**evaluate(kwargs['env_name'], alg, wm, obs_dim))
+                    if isinstance(buffer, MemmapBuffer):
+                        buffer.flush()
+                    else:
+                        buffer.save(f'{folder_name}saved_objects/replay_buffer/')
+                    visualise.eval_iteration_update(**evaluate(kwargs['env_name'], alg, wm, obs_dim, uint8=kwargs['obs_uint8']))
             s_t = s_tp1
 
+    if prefetcher is not None:
+        prefetcher.close()
     env.close()
     print('Environment closed.')
     visualise.close()
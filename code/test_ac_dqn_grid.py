@@ -3,10 +3,11 @@ import torch
 import gym
 import grid_gym  # Import necessary for GridWorld custom envs
 import numpy as np
-from modules.replay_buffers.replay_buffer import DynamicsReplayBuffer, ReplayBuffer
+from modules.replay_buffers.replay_buffer import ArrayDynamicsReplayBuffer
+from modules.replay_buffers.replay_buffer_torch import TensorDynamicsReplayBuffer
 from modules.algorithms.DQN import DQN
-from modules.world_models.world_model import EncodedWorldModel, WorldModelNoEncoder
-from utils.utils import transition_to_torch_no_r, CONV_LAYERS2014
+from modules.world_models.world_model import EncodedWorldModel, WorldModelNoEncoder, count_world_model
+from utils.utils import transition_to_torch_no_r, relabel_intrinsic_rewards, CONV_LAYERS2014
 from utils.visualise import Visualise
 from datetime import datetime
 import matplotlib.pyplot as plt
@@ -133,17 +134,28 @@ def warmup_wm(alg, wm, buffer, visualise, **kwargs):
         obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch = transition_to_torch_no_r(*batch)
         r_int_t = wm.train(obs_t_batch, a_t_batch, obs_tp1_batch, **{'memories': buffer})
         if alg.train_steps % kwargs['interval'] == 0:
-            visualise.eval_wm_warmup(i, **{k: np.mean(i[-100:]) for k, i in wm.losses.items() if i != []})
+            visualise.eval_wm_warmup(i, **{k: i.mean() for k, i in wm.losses.items() if len(i) > 0})
 
 
 def main(env, visualise, folder_name, **kwargs):
-    buffer = DynamicsReplayBuffer(kwargs['buffer_size'])
     obs_dim = tuple(env.observation_space.sample().shape)
     assert len(obs_dim) == 1, f'States should be 1D vector. Received: {obs_dim}'
     a_dim = (env.action_space.n,)
     device = 'cpu'  # 'cuda' if torch.cuda.is_available() else 'cpu'
+    relabel = kwargs['relabel_interval'] > 0
+    assert not (relabel and kwargs['tensor_buffer']), 'Intrinsic rewards are only stored by the array buffers.'
+    if kwargs['tensor_buffer']:
+        buffer = TensorDynamicsReplayBuffer(kwargs['buffer_size'], device=device, seed=kwargs['seed'])
+    else:
+        buffer = ArrayDynamicsReplayBuffer(kwargs['buffer_size'], seed=kwargs['seed'])
+    if kwargs['buffer_load_path'] != '':
+        buffer.load(kwargs['buffer_load_path'])
     alg = DQN(obs_dim, a_dim, device=device, **kwargs)
-    if kwargs['encoder_type'] == 'none':
+    if kwargs['wm_type'] == 'array_count':
+        assert kwargs['encoder_type'] == 'none', 'The count model counts raw states.'
+        assert kwargs['tab_index'] != 'str', 'The string keyed count model trains on single transitions, pick an array index.'
+        wm = count_world_model(obs_dim, a_dim, **kwargs)
+    elif kwargs['encoder_type'] == 'none':
         wm = WorldModelNoEncoder(obs_dim, a_dim, device=device, **kwargs)
     else:
         wm = EncodedWorldModel(obs_dim, a_dim, device=device, **args)
@@ -172,6 +184,8 @@ def main(env, visualise, folder_name, **kwargs):
                 if intr_rew_norm is not None:
                     r_int_t = normalize_rewards(r_int_t, total_history, intr_rew_norm)
                 alg.train(obs_t_batch, a_t_batch, r_int_t, obs_tp1_batch, dones_batch)
+                if relabel and alg.train_steps % kwargs['relabel_interval'] == 0:
+                    relabel_intrinsic_rewards(buffer, wm)
                 total_history['ext'].append(r_t)
             s_t = s_tp1
             if alg.train_steps % kwargs['export_interval'] == 0:
@@ -186,11 +200,13 @@ def main(env, visualise, folder_name, **kwargs):
                       f'Eps: {alg.epsilon:.3f}',
                       'Time elapsed:', f'{elapsed_time[0]}:{elapsed_time[1]}:{elapsed_time[2]}')
 
+                alg.flush_losses()
                 visualise.train_iteration_update(ext=ep_scores['DQN'][-1],
                                                  int=ep_scores['Mean intrinsic reward'][-1],
-                                                 **{k: np.mean(i[-100:]) for k, i in wm.losses.items() if i != []},
-                                                 alg_loss=np.mean(alg.losses[-100:]),
+                                                 **{k: i.mean() for k, i in wm.losses.items() if len(i) > 0},
+                                                 alg_loss=alg.losses.mean(),
                                                  info=info)
+                buffer.save(f'{folder_name}objects/replay_buffer/')
             if alg.train_steps % kwargs['eval_interval'] == 0:
                 if kwargs['env_name'][:9] == 'GridWorld':
                     draw_heat_map(info['density'], alg.train_steps, folder_name)
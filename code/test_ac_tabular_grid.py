@@ -13,7 +13,7 @@ import shutil
 from param_parse import parse_args
 from eval_wm import eval_wm
 from modules.algorithms.DQN import TabularQlearning, DQN
-from modules.world_models.world_model import TabularWorldModel, WorldModelNoEncoder, EncodedWorldModel, WorldModelContrastive, CountBasedWorldModel
+from modules.world_models.world_model import WorldModelNoEncoder, EncodedWorldModel, WorldModelContrastive, CountBasedWorldModel, ArrayCountBasedWorldModel, tabular_world_model, count_world_model
 from modules.replay_buffers.replay_buffer import DynamicsReplayBuffer
 import matplotlib.pyplot as plt
 
@@ -100,14 +100,15 @@ def main(env, visualise, folder_name, **kwargs):
     obs_dim = tuple(env.observation_space.sample().shape)
     assert len(obs_dim) == 1, f'States should be 1D vector. Received: {obs_dim}'
     a_dim = (env.action_space.n,)
+    assert kwargs['gridworld_ns_pool'] != 'batch', 'Training is done on single transitions, there are no in-batch negatives.'
     alg = TabularQlearning(obs_dim, a_dim, kwargs['gamma'], kwargs['eps_min'])
     enc, wm, has_separate_encoder = None, None, False
     if kwargs['encoder_type'] == 'none':
         device = 'cpu'
         if kwargs['wm_type'] == 'tab':
-            wm = TabularWorldModel(obs_dim, a_dim, kwargs['wm_lr'], **kwargs)
+            wm = tabular_world_model(obs_dim, a_dim, **kwargs)
         elif kwargs['wm_type'] == 'count':
-            wm = CountBasedWorldModel(obs_dim, a_dim, **kwargs)
+            wm = count_world_model(obs_dim, a_dim, **kwargs)
         elif kwargs['wm_type'] == 'nn':
             wm = WorldModelNoEncoder(obs_dim, a_dim, device=device, **kwargs)
         else:
@@ -119,29 +120,33 @@ def main(env, visualise, folder_name, **kwargs):
             if kwargs['wm_type'] == 'tab':
                 has_separate_encoder = True
                 enc = wm
-                wm = TabularWorldModel(kwargs['z_dim'], a_dim, kwargs['wm_lr'], **kwargs)
+                wm = tabular_world_model(kwargs['z_dim'], a_dim, **kwargs)
             elif kwargs['wm_type'] == 'count':
                 has_separate_encoder = True
                 enc = wm
-                wm = CountBasedWorldModel(kwargs['z_dim'], a_dim, **kwargs)
+                wm = count_world_model(kwargs['z_dim'], a_dim, **kwargs)
         else:
             wm = EncodedWorldModel(obs_dim, a_dim, device=device, **args)
             if kwargs['wm_type'] == 'tab':
                 has_separate_encoder = True
                 enc = wm
-                wm = TabularWorldModel(kwargs['z_dim'], a_dim, kwargs['wm_lr'], **kwargs)
+                wm = tabular_world_model(kwargs['z_dim'], a_dim, **kwargs)
             elif kwargs['wm_type'] == 'count':
                 has_separate_encoder = True
                 enc = wm
-                wm = CountBasedWorldModel(kwargs['z_dim'], a_dim, **kwargs)
+                wm = count_world_model(kwargs['z_dim'], a_dim, **kwargs)
     ep_scores = {'DQN': [0.0], 'Mean intrinsic reward': [0.0]}
     start_time = datetime.now()
     total_history = {'ext': [], 'int': []}
-    cont_buffer = DynamicsReplayBuffer(get_env_instance(kwargs['env_name']).history_len)
+    cont_buffer = None
     cont_visited = True if kwargs['gridworld_ns_pool'] == 'visited' else False
     cont_visited_uniform = True if kwargs['gridworld_ns_pool'] == 'visited_uniform' else False
+    if cont_visited:
+        cont_buffer = env.unwrapped  # Negatives are sampled from the env's visitation window
     if kwargs['encoder_type'] == 'cont' and kwargs['gridworld_ns_pool'] == 'uniform':
-        for s in get_env_instance(kwargs['env_name']).get_states():
+        uniform_env = get_env_instance(kwargs['env_name'])
+        cont_buffer = DynamicsReplayBuffer(uniform_env.history_len)
+        for s in uniform_env.get_states():
             cont_buffer.add(s, None, None, None)
         if has_separate_encoder:
             if kwargs['encoder_load_path'] is not None and kwargs['encoder_load_path'] != '':
@@ -166,10 +171,8 @@ def main(env, visualise, folder_name, **kwargs):
         while not done:
             a_t = alg.act(torch.from_numpy(s_t).to(dtype=torch.float32, device=device))
             s_tp1, r_t, done, info = env.step(a_t)
-            if kwargs['encoder_type'] == 'cont' and cont_visited:
-                cont_buffer.add(s_t, None, None, None)
-            elif kwargs['encoder_type'] == 'cont' and cont_visited_uniform:
-                cont_buffer = torch.from_numpy(info['visited_states']).to(dtype=torch.float32)
+            if kwargs['encoder_type'] == 'cont' and cont_visited_uniform:
+                cont_buffer = torch.from_numpy(env.unwrapped.get_unique_visited_states()).to(dtype=torch.float32)
             if alg.train_steps < kwargs['train_steps']:
                 # extra_args = {'memories': cont_buffer, 'distance': info['distance']}
                 extra_args = {'memories': cont_buffer}
@@ -199,8 +202,8 @@ def main(env, visualise, folder_name, **kwargs):
 
                     visualise.train_iteration_update(ext=ep_scores['DQN'][-1],
                                                      int=ep_scores['Mean intrinsic reward'][-1],
-                                                     **{k: np.mean(i[-100:]) for k, i in wm.losses.items() if i != []},
-                                                     alg_loss=np.mean(alg.losses[-100:]),
+                                                     **{k: i.mean() for k, i in wm.losses.items() if len(i) > 0},
+                                                     alg_loss=alg.losses.mean(),
                                                      info=info)
                 if alg.train_steps % kwargs['eval_interval'] == 0:
                     if kwargs['env_name'][:9] == 'GridWorld':
@@ -214,7 +217,7 @@ def main(env, visualise, folder_name, **kwargs):
                     wm.save(folder_name + 'saved_objects/')
             s_t = s_tp1
 
-            if not isinstance(wm, CountBasedWorldModel) and alg.train_steps % 50000 == 0:
+            if not isinstance(wm, (CountBasedWorldModel, ArrayCountBasedWorldModel)) and alg.train_steps % 50000 == 0:
                 for d in range(2, 20):
                     to_plot = []
                     for i, li in enumerate(wm.state_wise_loss_diff):
@@ -2,7 +2,7 @@
 import torch
 import gym
 import numpy as np
-from modules.replay_buffers.replay_buffer import DynamicsReplayBuffer, ReplayBuffer
+from modules.replay_buffers.replay_buffer import ArrayReplayBuffer
 from modules.algorithms.DQN import DQN
 from modules.world_models.world_model import EncodedWorldModel, WorldModelNoEncoder
 from utils.utils import standardize_state, transition_to_torch
@@ -88,11 +88,11 @@ def warmup_wm(alg, wm, buffer, visualise, **kwargs):
         obs_t_batch, a_t_batch, obs_tp1_batch, dones_batch = transition_to_torch(*batch)
         r_int_t = wm.train(obs_t_batch, a_t_batch, obs_tp1_batch, **{'memories': buffer})
         if alg.train_steps % kwargs['interval'] == 0:
-            visualise.eval_wm_warmup(i, **{k: np.mean(i[-100:]) for k, i in wm.losses.items() if i != []})
+            visualise.eval_wm_warmup(i, **{k: i.mean() for k, i in wm.losses.items() if len(i) > 0})
 
 
 def main(env, visualise, folder_name, **kwargs):
-    buffer = ReplayBuffer(kwargs['buffer_size'])
+    buffer = ArrayReplayBuffer(kwargs['buffer_size'], seed=kwargs['seed'])
     obs_dim = (kwargs['frame_stack'] if kwargs['grayscale'] else 3*kwargs['frame_stack'], *kwargs['resize_dim'])
     # obs_dim = env.observation_space.sample().shape
     assert len(obs_dim) == 3, 'States should be image (C, W, H).'
@@ -155,10 +155,11 @@ def main(env, visualise, folder_name, **kwargs):
                     os.makedirs(folder_name + 'objects/', exist_ok=True)
                     wm.save(path=f'{folder_name}objects/WM.pt')
                     alg.save(path=f'{folder_name}objects/DQN.pt')
+                    alg.flush_losses()
                     visualise.train_iteration_update(ext=ep_scores['DQN'][-1],
                                                      int=ep_scores['Mean intrinsic reward'][-1],
-                                                     **{k: np.mean(i[-100:]) for k, i in wm.losses.items() if i != []},
-                                                     alg_loss=np.mean(alg.losses[-100:]))
+                                                     **{k: i.mean() for k, i in wm.losses.items() if len(i) > 0},
+                                                     alg_loss=alg.losses.mean())
                 if alg.train_steps % kwargs['eval_interval'] == 0:
                     visualise.eval_iteration_update(**evaluate(kwargs['env_name'], alg, wm, obs_dim))
 
@@ -52,7 +52,7 @@ def clip_rewards(r_t):
     return np.clip(r_t, -1.0, 1.0)
 
 
-def standardize_state(s_t: np.ndarray, input_shape: tuple, grayscale=True) -> np.ndarray:
+def standardize_state(s_t: np.ndarray, input_shape: tuple, grayscale=True, uint8=False) -> np.ndarray:
     s_t = resize_image_numpy(s_t, input_shape[1:])
     if not (s_t.shape[0] == input_shape[0] or s_t.shape[0] == input_shape[0]*3):
         s_t = channel_first_numpy(s_t)
@@ -61,29 +61,63 @@ def standardize_state(s_t: np.ndarray, input_shape: tuple, grayscale=True) -> np
                input_shape[0] == input_shape[0]*3, 'input shape must be channels first for torch to be happy'
     if grayscale and s_t.shape[0] == 3:
         s_t = rgb_to_gray(s_t)
+    if uint8:  # Raw frames are scaled lazily by state_to_torch
+        return np.round(s_t).clip(0, 255).astype(np.uint8)
     s_t /= 256.0
     return s_t
 
 
-def transition_to_torch_no_r(s_t, a_t, s_tp1, d_t):
-    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> tuple
-    s_t = torch.from_numpy(s_t).to(dtype=torch.float32)
-    a_t = torch.from_numpy(a_t).to(dtype=torch.long)
-    s_tp1 = torch.from_numpy(s_tp1).to(dtype=torch.float32)
-    d_t = torch.from_numpy(d_t).to(dtype=torch.int8)
-    return s_t, a_t, s_tp1, d_t
+def state_to_torch(s_t, device='cpu'):
+    # type: (object, str) -> torch.Tensor
+    """"
+    Convert states (NumPy arrays or tensors of any buffer) to float32 on device. Raw uint8 frames are scaled in the same
+    way as in standardize_state.
+    """
+    s_t = torch.as_tensor(s_t)
+    if s_t.dtype == torch.uint8:
+        return s_t.to(dtype=torch.float32, device=device).div_(256.0)
+    return s_t.to(dtype=torch.float32, device=device)
+
+
+def transition_to_torch_no_r(s_t, a_t, s_tp1, d_t, *latents):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> tuple
+    """"
+    Latents cached by the replay buffer (e.g. z_t, z_tp1) may follow the transition, they are converted to float32.
+    """
+    s_t = state_to_torch(s_t)
+    a_t = torch.as_tensor(a_t).to(dtype=torch.long)
+    s_tp1 = state_to_torch(s_tp1)
+    d_t = torch.as_tensor(d_t).to(dtype=torch.int8)
+    return (s_t, a_t, s_tp1, d_t) + items_to_torch(latents)
 
 
 def transition_to_torch(s_t, a_t, r_t, s_tp1, d_t):
     # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> tuple
-    s_t = torch.from_numpy(s_t).to(dtype=torch.float32)
+    s_t = state_to_torch(s_t)
     a_t = torch.from_numpy(a_t).to(dtype=torch.long)
     r_t = torch.from_numpy(r_t).to(dtype=torch.float32)
-    s_tp1 = torch.from_numpy(s_tp1).to(dtype=torch.float32)
+    s_tp1 = state_to_torch(s_tp1)
     d_t = torch.from_numpy(d_t).to(dtype=torch.int8)
     return s_t, a_t, r_t, s_tp1, d_t
 
 
+def relabel_intrinsic_rewards(buffer, wm, chunk_size=4096):
+    # type: (object, object, int) -> None
+    """"
+    Re-score every transition of an ArrayReplayBuffer or ArrayDynamicsReplayBuffer with the current world model and
+    store the intrinsic rewards next to the transitions, streaming the buffer in chunks with one forward pass and one
+    vectorized reward write per chunk.
+    """
+    device = getattr(wm, 'device', 'cpu')
+    with torch.no_grad():
+        for idxes, fields in buffer.chunks(chunk_size):
+            s_t, a_t, s_tp1 = fields[0], fields[1], fields[-2]
+            r_int_t = wm.forward(state_to_torch(s_t, device),
+                                 torch.from_numpy(a_t).to(dtype=torch.long, device=device),
+                                 state_to_torch(s_tp1, device))
+            buffer.update_intrinsic_rewards(r_int_t.cpu().numpy().reshape(-1), idxes)
+
+
 def items_to_torch(items):
     # type: (tuple) -> tuple
     """"